@@ -0,0 +1,29 @@
+import typing as _t
+
+from .base import Backend, BackendUnavailable, Throttle
+from .local import LocalDirBackend, MountedVolumeBackend
+
+try:
+    from .s3 import S3Backend
+except ImportError as exc:
+    if exc.name not in ("boto3", "botocore"):
+        raise
+    _s3_exc = exc
+    S3Backend = None
+else:
+    _s3_exc = None
+
+
+def get_cls(name: str) -> _t.Type[Backend]:
+    """ The backend called ``name`` in the config: "local", "volume" or "s3"
+    """
+    if name == "local":
+        return LocalDirBackend
+    elif name == "volume":
+        return MountedVolumeBackend
+    elif name == "s3":
+        if _s3_exc is not None:
+            raise _s3_exc
+        return S3Backend
+    else:
+        raise ValueError(f"Unknown upload backend {name!r}")
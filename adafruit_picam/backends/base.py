@@ -0,0 +1,110 @@
+import contextlib
+import io
+import time
+import typing as t
+from abc import ABC
+from pathlib import Path
+
+import attr
+
+from .. import config
+
+T = t.TypeVar("T")
+
+Checkpoint = t.Callable[[], None]
+""" Saves an upload's ``state``, so it can resume from there after a failure """
+
+
+class BackendUnavailable(Exception):
+    """ The destination can't be reached right now, e.g. the volume isn't mounted
+    """
+
+
+@attr.s(auto_attribs=True)
+class Throttle:
+    """ Token bucket that limits the average rate of a transfer
+    """
+
+    bytes_per_s: t.Optional[float]
+    """ None for unlimited """
+    burst_bytes: float = 2 ** 20
+    _tokens: float = 0
+    _updated: float = attr.ib(factory=time.monotonic)
+
+    def consume(self, nbytes: int):
+        """ Wait until ``nbytes`` more may be sent
+        """
+        if self.bytes_per_s is None:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst_bytes, self._tokens + (now - self._updated) * self.bytes_per_s
+        )
+        self._updated = now
+        self._tokens -= nbytes
+        if self._tokens < 0:
+            time.sleep(-self._tokens / self.bytes_per_s)
+
+
+class ThrottledReader:
+    """ Read-only file wrapper whose reads wait for a `Throttle`
+
+    An HTTP client sends a file body as it reads it, so wrapping the body limits the
+    rate it goes out at. Reads return at most ``chunk_bytes``, to keep bursts short.
+    Every read is counted, including any the client makes before sending, e.g. to
+    compute a checksum; configure the client to avoid those.
+    """
+
+    def __init__(
+        self, stream: t.BinaryIO, throttle: Throttle, chunk_bytes: int = 64 * 1024
+    ):
+        self.stream = stream
+        self.throttle = throttle
+        self.chunk_bytes = chunk_bytes
+
+    def read(self, size: t.Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            return b"".join(iter(lambda: self.read(self.chunk_bytes), b""))
+        data = self.stream.read(min(size, self.chunk_bytes))
+        self.throttle.consume(len(data))
+        return data
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        return self.stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+
+class Backend(ABC):
+    """ A place photos are uploaded to
+
+    Backends are used from the upload process only, one upload at a time.
+    """
+
+    @classmethod
+    def initialize(cls: t.Type[T], cfg: config.Config, throttle: Throttle) -> T:
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        """ Context manager that releases connections on exit
+        """
+        raise NotImplementedError()
+
+    def upload(
+        self, src: Path, key: str, state: t.Dict[str, t.Any], checkpoint: Checkpoint
+    ):
+        """ Upload ``src`` as ``key``, replacing anything already there
+
+        Args:
+            src: photo to upload
+            key: destination name; a relative path with "/" separators
+            state: backend-specific progress of this upload, empty for a new one. Updated
+                in place; after a failure, it's passed back to resume the upload.
+            checkpoint: call after updating ``state`` to save it
+
+        Raises:
+            BackendUnavailable: if the destination can't be reached
+        """
+        raise NotImplementedError()
@@ -0,0 +1,79 @@
+import contextlib
+import os
+import typing as t
+from pathlib import Path
+
+import attr
+
+from .. import config
+from .base import Backend, BackendUnavailable, Checkpoint, Throttle
+
+T = t.TypeVar("T")
+
+CHUNK_BYTES = 256 * 1024
+PART_SUFFIX = ".part"
+
+
+@attr.s(auto_attribs=True)
+class LocalDirBackend(Backend):
+    """ Copies photos into another directory
+
+    Each photo is copied to a ``.part`` file, which is renamed once it's complete.
+    An interrupted copy carries on from the end of its ``.part`` file.
+    """
+
+    directory: Path
+    throttle: Throttle
+
+    @classmethod
+    def initialize(cls: t.Type[T], cfg: config.Config, throttle: Throttle) -> T:
+        if cfg.upload_dir is None:
+            raise ValueError(f"upload_dir must be set for the {cls.__name__}")
+        return cls(cfg.upload_dir, throttle)
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        yield  # nothing to release
+
+    def upload(
+        self, src: Path, key: str, state: t.Dict[str, t.Any], checkpoint: Checkpoint
+    ):
+        self.check_available()
+        dest = self.directory / key
+        part = dest.with_name(dest.name + PART_SUFFIX)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        with src.open("rb") as inp, part.open("ab") as out:
+            if out.tell() > os.fstat(inp.fileno()).st_size:
+                out.truncate(0)
+            inp.seek(out.tell())
+            while True:
+                chunk = inp.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.throttle.consume(len(chunk))
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(str(part), str(dest))
+
+    def check_available(self):
+        """
+        Raises:
+            BackendUnavailable: if photos can't be copied right now
+        """
+        pass
+
+
+class MountedVolumeBackend(LocalDirBackend):
+    """ Copies photos to a directory on a removable or network volume
+
+    Nothing is written unless the volume is mounted, so that photos don't pile up
+    on the SD card under an empty mount point.
+    """
+
+    def check_available(self):
+        path = self.directory.absolute()
+        while not os.path.ismount(str(path)):
+            path = path.parent
+        if path == Path(path.anchor):
+            raise BackendUnavailable(f"{self.directory} isn't on a mounted volume")
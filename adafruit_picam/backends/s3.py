@@ -0,0 +1,164 @@
+import base64
+import contextlib
+import hashlib
+import io
+import typing as t
+from pathlib import Path
+
+import attr
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from .. import config, root_logger
+from .base import Backend, Checkpoint, Throttle, ThrottledReader
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("s3")
+
+MIN_PART_BYTES = 5 * 2 ** 20
+""" S3's minimum size for all but the last part of a multipart upload """
+
+
+@attr.s(auto_attribs=True)
+class S3Backend(Backend):
+    """ Uploads photos to an S3-compatible object store, e.g. AWS or a MinIO server
+
+    One client is kept for the life of the upload process, so its connections are
+    reused. Photos larger than ``part_bytes`` are sent as multipart uploads, which
+    resume from the last finished part. Credentials come from boto3's usual
+    sources, such as environment variables or ``~/.aws/credentials``.
+    """
+
+    client: t.Any
+    bucket: str
+    prefix: str
+    part_bytes: int
+    throttle: Throttle
+
+    @classmethod
+    def initialize(cls: t.Type[T], cfg: config.Config, throttle: Throttle) -> T:
+        if cfg.upload_s3_bucket is None:
+            raise ValueError("upload_s3_bucket must be set for the s3 backend")
+        client = boto3.session.Session().client(
+            "s3", endpoint_url=cfg.upload_s3_endpoint, config=_client_config()
+        )
+        return cls(
+            client,
+            cfg.upload_s3_bucket,
+            cfg.upload_s3_prefix,
+            max(MIN_PART_BYTES, int(cfg.upload_part_mb * 2 ** 20)),
+            throttle,
+        )
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        yield  # the client's connection pool closes with the process
+
+    def upload(
+        self, src: Path, key: str, state: t.Dict[str, t.Any], checkpoint: Checkpoint
+    ):
+        key = self.prefix + key
+        size = src.stat().st_size
+        if size <= self.part_bytes:
+            with src.open("rb") as stream:
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Key=key,
+                    Body=ThrottledReader(stream, self.throttle),
+                    ContentLength=size,
+                    ContentMD5=_content_md5(stream),
+                )
+            return
+
+        parts = self._resume(key, state)
+        if parts is None:
+            upload = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)
+            state.clear()
+            state.update(upload_id=upload["UploadId"], part_bytes=self.part_bytes)
+            checkpoint()
+            parts = {}
+        upload_id = state["upload_id"]
+
+        with src.open("rb") as stream:
+            for number in range(1, -(-size // self.part_bytes) + 1):
+                if number in parts:
+                    continue
+                stream.seek((number - 1) * self.part_bytes)
+                data = stream.read(self.part_bytes)
+                part = io.BytesIO(data)
+                response = self.client.upload_part(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=number,
+                    Body=ThrottledReader(part, self.throttle),
+                    ContentLength=len(data),
+                    ContentMD5=_content_md5(part),
+                )
+                parts[number] = response["ETag"]
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": etag}
+                    for number, etag in sorted(parts.items())
+                ]
+            },
+        )
+
+    def _resume(
+        self, key: str, state: t.Dict[str, t.Any]
+    ) -> t.Optional[t.Dict[int, str]]:
+        """ The parts already sent by an interrupted upload, or None to start over
+        """
+        if "upload_id" not in state:
+            return None
+        if state.get("part_bytes") != self.part_bytes:
+            LOGGER.info(f"Part size changed; restarting upload of {key}")
+            self._abort(key, state["upload_id"])
+            return None
+        try:
+            response = self.client.list_parts(
+                Bucket=self.bucket, Key=key, UploadId=state["upload_id"]
+            )
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] != "NoSuchUpload":
+                raise
+            LOGGER.info(f"Interrupted upload of {key} has expired; restarting it")
+            return None
+        return {p["PartNumber"]: p["ETag"] for p in response.get("Parts", [])}
+
+    def _abort(self, key: str, upload_id: str):
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id
+            )
+        except ClientError:
+            LOGGER.warning(f"Failed to abort upload of {key}", exc_info=True)
+
+
+def _client_config() -> Config:
+    """ Client options that keep botocore from reading each body before sending it
+
+    Those extra reads would go through the throttle too. Integrity is checked with
+    Content-MD5 instead, which is computed from the local file.
+    """
+    options = dict(s3={"payload_signing_enabled": False})
+    if "request_checksum_calculation" in Config.OPTION_DEFAULTS:  # botocore >= 1.36
+        options["request_checksum_calculation"] = "when_required"
+    return Config(**options)
+
+
+def _content_md5(stream: t.BinaryIO) -> str:
+    """ Base64 MD5 of the rest of ``stream``, for the Content-MD5 header """
+    start = stream.tell()
+    md5 = hashlib.md5()
+    for chunk in iter(lambda: stream.read(2 ** 20), b""):
+        md5.update(chunk)
+    stream.seek(start)
+    return base64.b64encode(md5.digest()).decode()
@@ -1,6 +1,6 @@
 import typing as _t
 
-from .base import Camera
+from .base import Camera, Frame, PixelFormat, PIXEL_FORMATS, DEFAULT_PIXEL_FORMAT
 
 from .mock import MockCamera
 
@@ -2,16 +2,92 @@ import contextlib
 import typing as t
 from abc import ABC
 
+import attr
 import pygame
 
 from .. import config, constants
 
 T = t.TypeVar("T")
+K = t.TypeVar("K")
+
+
+@attr.s(frozen=True, auto_attribs=True)
+class PixelFormat:
+    """ Layout of unencoded preview pixels, as delivered by the camera
+
+    ``masks``/``shifts`` override the channel layout that pygame infers from
+    ``pygame_format``, for layouts that ``frombuffer`` can't describe directly.
+    Masks are for little-endian 32-bit words, as on the Pi.
+    """
+
+    name: str
+    """ picamera's name for the format """
+    pygame_format: str
+    bytes_per_pixel: int
+    masks: t.Optional[t.Tuple[int, int, int, int]] = None
+    shifts: t.Optional[t.Tuple[int, int, int, int]] = None
+
+
+PIXEL_FORMATS = {
+    fmt.name: fmt
+    for fmt in (
+        PixelFormat("rgb", "RGB", 3),
+        PixelFormat("rgba", "RGBX", 4),
+        # XRGB8888 in native byte order: the source layout for SDL's fast
+        # 32 -> 16 bit blitter, and a plain copy onto 32-bit XRGB displays
+        PixelFormat(
+            "bgra", "RGBX", 4, masks=(0xFF0000, 0xFF00, 0xFF, 0), shifts=(16, 8, 0, 0)
+        ),
+    )
+}
+DEFAULT_PIXEL_FORMAT = PIXEL_FORMATS["rgb"]
+
+
+@attr.s(auto_attribs=True, eq=False)
+class Frame:
+    """ A reusable preview image: a pixel buffer with a pygame surface built on top of it
+    """
+
+    buffer: bytearray
+    surface: pygame.Surface
+
+    @classmethod
+    def allocate(
+        cls: t.Type[K],
+        size: t.Tuple[int, int],
+        buffer_size: t.Optional[t.Tuple[int, int]] = None,
+        pixel_format: PixelFormat = DEFAULT_PIXEL_FORMAT,
+    ) -> K:
+        """ Allocate a frame for ``size`` images
+
+        Args:
+            size: dimensions of the visible image
+            buffer_size: dimensions of the underlying buffer, if rows or columns
+               are padded (default: same as ``size``)
+            pixel_format: layout of the pixels that will be written to the buffer
+        """
+        buffer_size = buffer_size or size
+        buffer = bytearray(
+            buffer_size[0] * buffer_size[1] * pixel_format.bytes_per_pixel
+        )
+        surface = pygame.image.frombuffer(
+            buffer, buffer_size, pixel_format.pygame_format
+        )
+        if pixel_format.masks:
+            surface.set_masks(pixel_format.masks)
+            surface.set_shifts(pixel_format.shifts)
+        if buffer_size != size:
+            surface = surface.subsurface((0, 0) + tuple(size))
+        return cls(buffer, surface)
 
 
 class Camera(ABC):
     @classmethod
-    def initialize(cls: t.Type[T], settings: config.Settings) -> T:
+    def initialize(
+        cls: t.Type[T],
+        cfg: config.Config,
+        pixel_format: PixelFormat = DEFAULT_PIXEL_FORMAT,
+    ) -> T:
         raise NotImplementedError()
 
     @contextlib.contextmanager
@@ -21,11 +97,55 @@ class Camera(ABC):
     def get_preview(self) -> pygame.Surface:
         raise NotImplementedError()
 
+    def next_preview(self, timeout: t.Optional[float] = None) -> pygame.Surface:
+        """ Like `get_preview`, but blocks until a frame newer than the last one is ready
+        """
+        return self.get_preview()
+
+    def new_frame(self) -> Frame:
+        """ Allocate a frame that `read_preview` can fill
+        """
+        raise NotImplementedError()
+
+    def read_preview(self, frame: Frame, timeout: t.Optional[float] = None):
+        """ Copy the next preview image into ``frame``
+        """
+        frame.surface.blit(self.next_preview(timeout), (0, 0))
+
     def write_picture(
         self, stream: t.BinaryIO, settings: config.Settings,
     ):
         raise NotImplementedError()
 
+    @property
+    def max_preview_framerate(self) -> t.Optional[float]:
+        """ Fastest framerate `set_preview_mode` will use, or None if it isn't limited
+        """
+        return None
+
+    def set_preview_mode(self, resolution: t.Tuple[int, int], framerate: float):
+        """ Change the size and rate of preview frames
+
+        Frames from `new_frame` allocated before the change must not be used after it.
+        """
+        raise NotImplementedError()
+
+    def write_burst(
+        self, streams: t.Iterator[t.BinaryIO], settings: config.Settings,
+    ):
+        """ Capture pictures back-to-back, one into each stream, until ``streams`` is exhausted
+
+        The next stream is only requested once the previous picture is complete.
+        """
+        for stream in streams:
+            self.write_picture(stream, settings)
+
+    @property
+    def stills_during_preview(self) -> bool:
+        """ Whether `write_picture` can run while another thread reads previews
+        """
+        return False
+
     def setup(self, settings: config.Settings):
         raise NotImplementedError()
 
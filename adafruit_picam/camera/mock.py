@@ -1,16 +1,16 @@
 import contextlib
+import time
 import typing as t
-import io
 from pathlib import Path
 import pkg_resources
-import shutil
 
 import attr
+import pygame
 
 from .. import __name__ as pkgname
 from .. import config, constants, root_logger
 
-from .base import Camera
+from .base import Camera, Frame, PixelFormat, DEFAULT_PIXEL_FORMAT
 
 T = t.TypeVar("T")
 
@@ -19,28 +19,76 @@ LOGGER = root_logger.getChild("fakecam")
 
 @attr.s(auto_attribs=True)
 class MockCamera(Camera):
-    img_paths: t.List[Path]
+    """ Stand-in camera that cycles through the bundled ``fakephotos``
+
+    The photos are decoded and scaled to preview size once, up front, so serving a
+    frame costs nothing but the optional pacing and injected latency.
+    """
+
+    sources: t.List[pygame.Surface]
+    """ The decoded photos at full size """
+    previews: t.List[pygame.Surface]
+    jpegs: t.List[bytes]
+    preview_resolution: t.Tuple[int, int]
+    pixel_format: PixelFormat = DEFAULT_PIXEL_FORMAT
+    fps: t.Optional[float] = None
+    """ Maximum rate at which previews are served (None for unlimited)"""
+    latency_s: float = 0
+    """ Simulated delay added to every frame """
     i_img: int = 0
+    last_frame_time: float = 0
 
     @classmethod
-    def initialize(cls: t.Type[T], settings: config.Settings) -> T:
+    def initialize(
+        cls: t.Type[T],
+        cfg: config.Config,
+        pixel_format: PixelFormat = DEFAULT_PIXEL_FORMAT,
+    ) -> T:
         imgdir = Path(pkg_resources.resource_filename(pkgname, "fakephotos"))
-        paths = list(imgdir.glob("*.jpg"))
+        paths = sorted(imgdir.glob("*.jpg"))
         assert paths
-        LOGGER.info("Initialized fake camera")
-        return cls(paths)
+        sources = [pygame.image.load(str(path)) for path in paths]
+        previews = [pygame.transform.scale(img, cfg.screensize) for img in sources]
+        jpegs = [path.read_bytes() for path in paths]
+        LOGGER.info(f"Initialized fake camera with {len(paths)} images")
+        return cls(
+            sources,
+            previews,
+            jpegs,
+            preview_resolution=cfg.screensize,
+            pixel_format=pixel_format,
+            fps=cfg.mock_camera_fps,
+            latency_s=cfg.mock_camera_latency_s,
+        )
 
     @contextlib.contextmanager
     def cleanup(self):
+        yield
         LOGGER.info("fake camera closed cleanly")
 
-    def get_preview(self) -> io.BytesIO:
-        self.i_img += 1
-        return self.img_paths[self.i_img % len(self.img_paths)].open("rb")
+    def get_preview(self) -> pygame.Surface:
+        # paced here rather than in `next_preview` (which calls this), so the main
+        # loop sees the same camera with or without threaded capture
+        if self.fps:
+            wait = self.last_frame_time + 1 / self.fps - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        self.last_frame_time = time.monotonic()
+        self.i_img = (self.i_img + 1) % len(self.previews)
+        return self.previews[self.i_img]
+
+    def new_frame(self) -> Frame:
+        return Frame.allocate(self.preview_resolution, pixel_format=self.pixel_format)
+
+    def set_preview_mode(self, resolution: t.Tuple[int, int], framerate: float):
+        self.preview_resolution = resolution
+        self.previews = [pygame.transform.scale(img, resolution) for img in self.sources]
+        self.fps = framerate
 
-    def write_picture(self, stream: t.BinaryIO, format):
-        with self.img_paths[self.i_img].open("rb") as src:
-            shutil.copyfileobj(src, stream)
+    def write_picture(self, stream: t.BinaryIO, settings: config.Settings):
+        stream.write(self.jpegs[self.i_img])
 
     def setup(self, settings: config.Settings):
         pass
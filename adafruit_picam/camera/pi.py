@@ -1,78 +1,323 @@
 import contextlib
-import functools
+import threading
 import typing as t
-import io
 
 import attr
 import pygame
 from picamera import PiCamera
 
-from .. import constants, config
-from .base import Camera
+from .. import constants, config, root_logger
+from .base import Camera, Frame, PixelFormat, DEFAULT_PIXEL_FORMAT
 
 T = t.TypeVar("T")
 
+LOGGER = root_logger.getChild("picam")
 
-@functools.lru_cache()
-def _buffer(size: t.Tuple[int, int]) -> bytearray:
-    return bytearray(size[0] * size[1] * 3)
+STILL_SPLITTER_PORT = 0
+PREVIEW_SPLITTER_PORT = 1
+FIXED_RESOLUTION_FRAMERATE = 15
+""" Fastest rate of the full-resolution sensor modes on both camera versions """
+STREAM_START_TIMEOUT_S = 5.0
+""" How long `RaspberryPiCamera.get_preview` waits for the stream's first frame """
 
 
-@attr.s(auto_attribs=True, frozen=True)
+def _raw_resolution(size: t.Tuple[int, int]) -> t.Tuple[int, int]:
+    """ Size of unencoded frames from the GPU, which pads width to 32 and height to 16
+    """
+    return (size[0] + 31) // 32 * 32, (size[1] + 15) // 16 * 16
+
+
+def _new_frame(size: t.Tuple[int, int], pixel_format: PixelFormat) -> Frame:
+    return Frame.allocate(size, _raw_resolution(size), pixel_format)
+
+
+class _PreviewOutput:
+    """ Writable sink that the camera fills in place
+
+    Each frame is a single copy out of the camera's buffer into a preallocated
+    `Frame`, with no allocations. A frame requested via `fill` receives the next
+    complete image; otherwise images land in ``default``. ``PiCamera`` calls
+    ``write`` from its own callback thread while streaming.
+    """
+
+    def __init__(self, default: Frame):
+        self.default = default
+        self.frames = 0
+        """ Number of complete frames written so far """
+        self.new_frame = threading.Condition()
+
+        self._target = default
+        self._pending: t.Optional[Frame] = None
+        self._filled: t.Optional[Frame] = None
+        self._view = memoryview(default.buffer)
+        self._pos = 0
+
+    def write(self, b: bytes) -> int:
+        # usually one whole frame, but a write may also end or start one partway
+        data = memoryview(b)
+        while data:
+            if self._pos == 0:
+                # only switch targets between frames
+                with self.new_frame:
+                    self._target = self._pending or self.default
+                    self._pending = None
+                self._view = memoryview(self._target.buffer)
+
+            n = min(len(data), len(self._view) - self._pos)
+            self._view[self._pos : self._pos + n] = data[:n]
+            data = data[n:]
+            self._pos += n
+            if self._pos >= len(self._view):
+                self._pos = 0
+                with self.new_frame:
+                    self.frames += 1
+                    self._filled = self._target
+                    self.new_frame.notify_all()
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def rewind(self):
+        self._pos = 0
+
+    def reset(self, default: Frame):
+        """ Start writing into a new ``default`` frame, e.g. after a resolution change
+        """
+        with self.new_frame:
+            self.default = default
+            self._target = default
+            self._pending = None
+            self._filled = None
+        self._view = memoryview(default.buffer)
+        self._pos = 0
+
+    def wait_for_frame(self, after: int, timeout: t.Optional[float]) -> bool:
+        """ Block until more than ``after`` frames have been written
+        """
+        with self.new_frame:
+            return self.new_frame.wait_for(lambda: self.frames > after, timeout)
+
+    def request(self, frame: Frame):
+        """ Have the next complete image written into ``frame`` rather than ``default``
+        """
+        with self.new_frame:
+            self._pending = frame
+            self._filled = None
+
+    def wait_filled(self, frame: Frame, timeout: t.Optional[float]) -> bool:
+        """ Block until a `request`-ed ``frame`` has been filled
+        """
+        with self.new_frame:
+            return self.new_frame.wait_for(lambda: self._filled is frame, timeout)
+
+
+@attr.s(auto_attribs=True)
 class RaspberryPiCamera(Camera):
     camera: "PiCamera"
     preview_resolution: t.Tuple[int, int]
     max_resolution: t.Tuple[int, int]
+    preview: _PreviewOutput
+    pixel_format: PixelFormat = DEFAULT_PIXEL_FORMAT
+    streaming: bool = True
+    """ Keep the video port recording into ``preview`` rather than capturing per frame"""
+    fixed_resolution: bool = False
+    """ Leave the sensor at ``max_resolution`` and resize previews on the GPU """
 
     @classmethod
-    def initialize(cls: t.Type[T], cfg: config.Config) -> T:
-        camera = PiCamera(resolution=cfg.screensize)
-        return cls(
+    def initialize(
+        cls: t.Type[T],
+        cfg: config.Config,
+        pixel_format: PixelFormat = DEFAULT_PIXEL_FORMAT,
+    ) -> T:
+        if cfg.fixed_resolution_capture:
+            camera = PiCamera(
+                resolution=cfg.camera_resolution, framerate=FIXED_RESOLUTION_FRAMERATE
+            )
+        else:
+            camera = PiCamera(resolution=cfg.screensize)
+        cam = cls(
             camera,
             preview_resolution=cfg.screensize,
             max_resolution=cfg.camera_resolution,
+            preview=_PreviewOutput(_new_frame(cfg.screensize, pixel_format)),
+            pixel_format=pixel_format,
+            streaming=cfg.streaming_preview,
+            fixed_resolution=cfg.fixed_resolution_capture,
         )
+        cam.start_preview_stream()
+        return cam
 
     @contextlib.contextmanager
     def cleanup(self):
         """ Context manager that releases resources on exit
         """
         yield
+        self.stop_preview_stream()
         self.camera.close()
 
+    def start_preview_stream(self):
+        """ Keep the video port running, delivering every preview frame to ``self.preview``
+        """
+        if not self.streaming:
+            return
+        self.preview.rewind()
+        self.camera.start_recording(
+            self.preview,
+            format=self.pixel_format.name,
+            splitter_port=PREVIEW_SPLITTER_PORT,
+            resize=self._preview_resize,
+        )
+        LOGGER.info(f"Started streaming {self.pixel_format.name} preview")
+
+    def stop_preview_stream(self):
+        if not self.streaming or not self.camera.recording:
+            return
+        self.camera.stop_recording(splitter_port=PREVIEW_SPLITTER_PORT)
+
+    @property
+    def _preview_resize(self) -> t.Optional[t.Tuple[int, int]]:
+        return self.preview_resolution if self.fixed_resolution else None
+
+    @property
+    def stills_during_preview(self) -> bool:
+        return self.fixed_resolution and self.streaming
+
+    def _capture_preview(self):
+        self.preview.rewind()
+        self.camera.capture(
+            self.preview,
+            use_video_port=True,
+            format=self.pixel_format.name,
+            resize=self._preview_resize,
+        )
+
+    @contextlib.contextmanager
+    def paused_preview_stream(self):
+        """ Context manager that stops the preview stream so the camera can be reconfigured
+        """
+        self.stop_preview_stream()
+        try:
+            yield
+        finally:
+            self.start_preview_stream()
+
     def get_preview(self) -> pygame.Surface:
-        data = _buffer(self.camera.resolution)
-        with io.BytesIO() as stream:
-            self.camera.capture(stream, use_video_port=True, format="rgb")
-            stream.seek(0)
-            stream.readinto(data)
+        """ Return the newest preview frame
 
-        img = pygame.image.frombuffer(data, self.camera.resolution, "RGB")
-        return img
+        The same surface is returned every call; its pixels are updated in place.
+        """
+        if self.streaming:
+            # only blocks until the first frame arrives
+            if not self.preview.wait_for_frame(0, STREAM_START_TIMEOUT_S):
+                raise TimeoutError("No frames received from preview stream")
+        else:
+            self._capture_preview()
+        return self.preview.default.surface
+
+    def new_frame(self) -> Frame:
+        return _new_frame(self.preview_resolution, self.pixel_format)
+
+    def read_preview(self, frame: Frame, timeout: t.Optional[float] = None):
+        self.preview.request(frame)
+        if not self.streaming:
+            self._capture_preview()
+        if not self.preview.wait_filled(frame, timeout):
+            raise TimeoutError("No frames received from preview stream")
+
+    def _still_resolution(self, settings: config.Settings) -> t.Tuple[int, int]:
+        res = self.max_resolution
+        if settings.size_mode.value != 1:
+            res = (
+                res[0] // settings.size_mode.value,
+                res[1] // settings.size_mode.value,
+            )
+        return res
 
     def write_picture(
         self, stream: t.BinaryIO, settings: config.Settings, fmt: str = "jpeg"
     ):
-        # get resolution
-        res = self.max_resolution
-        if settings.size_mode.value != 1:
-            res = (res[0] / settings.size_mode.value, res[1] / settings.size_mode.value)
+        res = self._still_resolution(settings)
 
-        try:
-            self.camera.resolution = res
+        if self.fixed_resolution:
+            # the video port is already running at full resolution: take the still
+            # from its other splitter output, resizing on the GPU if needed
             self.camera.capture(
-                stream, use_video_port=False, format=fmt, thumbnail=None
+                stream,
+                use_video_port=True,
+                splitter_port=STILL_SPLITTER_PORT,
+                format=fmt,
+                resize=None if res == self.max_resolution else res,
+                thumbnail=None,
             )
-        finally:
-            self.camera.resolution = self.preview_resolution
+            return
+
+        # the resolution can't change while the video port is recording
+        with self.paused_preview_stream():
+            try:
+                self.camera.resolution = res
+                self.camera.capture(
+                    stream, use_video_port=False, format=fmt, thumbnail=None
+                )
+            finally:
+                self.camera.resolution = self.preview_resolution
+
+    def write_burst(
+        self,
+        streams: t.Iterator[t.BinaryIO],
+        settings: config.Settings,
+        fmt: str = "jpeg",
+    ):
+        """ Capture a sequence of pictures from the video port, which is much faster than
+        the still port (at the cost of some denoising)
+        """
+        res = self._still_resolution(settings)
+
+        if self.fixed_resolution:
+            self.camera.capture_sequence(
+                streams,
+                use_video_port=True,
+                splitter_port=STILL_SPLITTER_PORT,
+                format=fmt,
+                resize=None if res == self.max_resolution else res,
+                thumbnail=None,
+            )
+            return
+
+        with self.paused_preview_stream():
+            try:
+                self.camera.resolution = res
+                self.camera.capture_sequence(
+                    streams,
+                    use_video_port=True,
+                    splitter_port=STILL_SPLITTER_PORT,
+                    format=fmt,
+                    thumbnail=None,
+                )
+            finally:
+                self.camera.resolution = self.preview_resolution
+
+    @property
+    def max_preview_framerate(self) -> t.Optional[float]:
+        return FIXED_RESOLUTION_FRAMERATE if self.fixed_resolution else None
+
+    def set_preview_mode(self, resolution: t.Tuple[int, int], framerate: float):
+        if self.fixed_resolution:
+            framerate = min(framerate, FIXED_RESOLUTION_FRAMERATE)
+        with self.paused_preview_stream():
+            self.preview_resolution = resolution
+            self.preview.reset(self.new_frame())
+            if not self.fixed_resolution:
+                self.camera.resolution = resolution
+            self.camera.framerate = framerate
+        LOGGER.info(f"Preview mode: {resolution[0]}x{resolution[1]} @ {framerate:g} fps")
 
     def setup(self, settings: config.Settings):
         self.set_fx_mode(settings.fx_mode)
         self.set_iso_mode(settings.iso_mode)
 
     def set_fx_mode(self, mode: constants.Fx):
-        self.camera.image_effect = [mode.value]
-        # buttons[6][5].setBg("fx-" + fxData[fxMode])
+        self.camera.image_effect = mode.value
 
     def set_iso_mode(self, iso: constants.IsoSetting):
         self.camera.ISO = iso.iso
@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+import attr
+
+from . import root_logger
+from .constants import SizeMode
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("capacity")
+
+DEFAULT_PHOTO_BYTES = 4 * 2 ** 20
+""" Assumed size of a full-size photo until one has been written """
+SMOOTHING = 0.2
+""" Weight of the newest photo in the moving average of photo sizes """
+
+
+@attr.s(auto_attribs=True)
+class CapacityMonitor:
+    """ Tracks the free space for photos without calling statvfs for every write
+
+    Writes and deletes adjust an estimate of the free bytes, which is corrected
+    with statvfs at most every ``refresh_interval_s``. All methods are thread-safe.
+    """
+
+    path: Path
+    reserve_bytes: int
+    """ Space to leave free for the rest of the system """
+    refresh_interval_s: float
+
+    free_bytes: int = 0
+    block_size: int = 1
+    photo_bytes: t.Dict[SizeMode, float] = attr.ib(factory=dict)
+    """ Moving average of the size of a photo at each size mode """
+    checked_at: float = 0
+    _lock: threading.Lock = attr.ib(factory=threading.Lock)
+
+    @classmethod
+    def initialize(
+        cls: t.Type[T], path: Path, reserve_bytes: int, refresh_interval_s: float
+    ) -> T:
+        monitor = cls(path, reserve_bytes, refresh_interval_s)
+        monitor.refresh()
+        return monitor
+
+    def refresh(self):
+        """ Re-read the free space from the filesystem
+        """
+        st = os.statvfs(str(self.path))
+        with self._lock:
+            self.free_bytes = st.f_bavail * st.f_frsize
+            self.block_size = st.f_frsize
+            self.checked_at = time.monotonic()
+
+    def poll(self):
+        """ Refresh if the last statvfs is older than ``refresh_interval_s``. Cheap to call every frame.
+        """
+        if time.monotonic() - self.checked_at >= self.refresh_interval_s:
+            self.refresh()
+
+    def record_write(self, nbytes: int):
+        with self._lock:
+            self.free_bytes -= self._blocks(nbytes)
+
+    def record_delete(self, nbytes: int):
+        with self._lock:
+            self.free_bytes += self._blocks(nbytes)
+
+    def record_photo(self, size_mode: SizeMode, nbytes: int):
+        """ Learn how big photos are at ``size_mode``
+        """
+        with self._lock:
+            prev = self.photo_bytes.get(size_mode, nbytes)
+            self.photo_bytes[size_mode] = prev + SMOOTHING * (nbytes - prev)
+
+    def expected_bytes(self, size_mode: SizeMode) -> float:
+        """ Estimated size of the next photo at ``size_mode``
+        """
+        with self._lock:
+            if size_mode in self.photo_bytes:
+                return self.photo_bytes[size_mode]
+            # scale from another size by the number of pixels
+            for other, nbytes in self.photo_bytes.items():
+                return nbytes * (other.value / size_mode.value) ** 2
+        return DEFAULT_PHOTO_BYTES / size_mode.value ** 2
+
+    def photos_left(self, size_mode: SizeMode) -> int:
+        """ Estimated number of photos at ``size_mode`` that still fit
+        """
+        available = self.free_bytes - self.reserve_bytes
+        return max(0, int(available // self.expected_bytes(size_mode)))
+
+    def _blocks(self, nbytes: int) -> int:
+        """ ``nbytes`` rounded up to whole filesystem blocks """
+        return -(-nbytes // self.block_size) * self.block_size
+
+
+def smaller_size_mode(size_mode: SizeMode) -> t.Optional[SizeMode]:
+    """ The next smaller picture size, or None if ``size_mode`` is the smallest
+    """
+    smaller = [m for m in SizeMode if m.value > size_mode.value]
+    return min(smaller, key=lambda m: m.value) if smaller else None
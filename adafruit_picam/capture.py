@@ -0,0 +1,203 @@
+import contextlib
+import threading
+import typing as t
+
+import attr
+import pygame
+
+from . import root_logger
+from .camera import Frame
+
+if t.TYPE_CHECKING:
+    from .camera import Camera
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("capture")
+
+FRAME_TIMEOUT_S = 5.0
+FILL_TIMEOUT_S = 10.0
+""" How long `CaptureWorker` waits for a frame after (re)configuring the camera """
+JOIN_TIMEOUT_S = 5.0
+
+
+@attr.s(auto_attribs=True)
+class FramePool:
+    """ A fixed set of preview frames passed between one producer and one consumer
+
+    Each frame has exactly one owner at a time: it is either free, being filled
+    by the producer (`acquire`), waiting in the single-slot mailbox (`publish`),
+    or on screen with the consumer (`take`). The consumer's frame is only
+    returned to the pool once it takes a newer one, so pixels are never
+    overwritten while they're being drawn.
+    """
+
+    _free: t.List[Frame]
+    _ready: t.Optional[Frame] = None
+    _held: t.Optional[Frame] = None
+    _lock: threading.Lock = attr.ib(factory=threading.Lock)
+
+    @classmethod
+    def allocate(cls: t.Type[T], count: int, factory: t.Callable[[], Frame]) -> T:
+        if count < 2:
+            raise ValueError(f"Need at least 2 preview buffers, not {count}")
+        return cls([factory() for _ in range(count)])
+
+    @property
+    def held(self) -> t.Optional[Frame]:
+        """ The frame currently owned by the consumer """
+        return self._held
+
+    def acquire(self) -> Frame:
+        """ Producer: take ownership of a frame to fill
+
+        If there are no free frames, the stale frame in the mailbox is reclaimed.
+        """
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            frame, self._ready = self._ready, None
+        assert frame is not None, "frame pool exhausted; is there more than one producer?"
+        return frame
+
+    def release(self, frame: Frame):
+        """ Producer: give back a frame without publishing it
+        """
+        with self._lock:
+            self._free.append(frame)
+
+    def publish(self, frame: Frame):
+        """ Producer: hand a filled frame to the mailbox, replacing any untaken frame
+        """
+        with self._lock:
+            if self._ready is not None:
+                self._free.append(self._ready)
+            self._ready = frame
+
+    def take(self) -> t.Optional[Frame]:
+        """ Consumer: take ownership of the newest frame, returning the previous one
+
+        Returns None (and keeps the current frame) if nothing new has been published.
+        Never blocks on the producer.
+        """
+        with self._lock:
+            if self._ready is None:
+                return None
+            if self._held is not None:
+                self._free.append(self._held)
+            self._held, self._ready = self._ready, None
+            return self._held
+
+
+@attr.s(auto_attribs=True)
+class CaptureWorker:
+    """ Background thread that keeps a `FramePool` filled with camera previews
+
+    All other access to the camera must happen inside `paused` so that it doesn't
+    race with the worker.
+    """
+
+    camera: "Camera"
+    pool: FramePool
+    num_buffers: int = 2
+    error: t.Optional[BaseException] = None
+
+    _camera_lock: threading.Lock = attr.ib(factory=threading.Lock)
+    _running: threading.Event = attr.ib(factory=threading.Event)
+    _stop: threading.Event = attr.ib(factory=threading.Event)
+    _thread: t.Optional[threading.Thread] = None
+
+    @classmethod
+    def initialize(cls: t.Type[T], camera: "Camera", num_buffers: int) -> T:
+        """ Start the worker, and block until the first frame is ready
+        """
+        pool = FramePool.allocate(num_buffers, camera.new_frame)
+        worker = cls(camera, pool, num_buffers=num_buffers)
+        worker.fill(FILL_TIMEOUT_S)
+        worker.pool.take()
+        worker._running.set()
+        worker._thread = threading.Thread(
+            target=worker.run, name="capture", daemon=True
+        )
+        worker._thread.start()
+        LOGGER.info("Capture worker started")
+        return worker
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        """ Context manager that stops the worker thread on exit
+        """
+        yield
+        self._stop.set()
+        self._thread.join(timeout=JOIN_TIMEOUT_S)
+        if self._thread.is_alive():
+            LOGGER.error("capture thread failed to terminate")
+
+    def run(self):
+        try:
+            while not self._stop.is_set():
+                if not self._running.wait(FRAME_TIMEOUT_S):
+                    continue
+                with self._camera_lock:
+                    self.fill(FRAME_TIMEOUT_S)
+        except Exception as exc:
+            LOGGER.error("capture thread crashed", exc_info=True)
+            self.error = exc
+
+    def fill(self, timeout: float):
+        """ Read one preview into a frame from the pool and publish it
+        """
+        frame = self.pool.acquire()
+        try:
+            self.camera.read_preview(frame, timeout=timeout)
+        except BaseException:
+            self.pool.release(frame)
+            raise
+        self.pool.publish(frame)
+
+    def latest(self) -> pygame.Surface:
+        """ The newest available frame; never waits for the camera
+
+        The returned surface stays valid until the next call.
+        """
+        if self.error is not None:
+            raise RuntimeError("capture thread crashed") from self.error
+        self.pool.take()
+        return self.pool.held.surface
+
+    def reconfigure(self, configure: t.Callable[[], None]):
+        """ Pause the worker, call ``configure`` to change the camera's preview, and
+        reallocate the frame pool to match. Blocks until a new frame is ready.
+        """
+        with self.paused():
+            configure()
+            self.pool = FramePool.allocate(self.num_buffers, self.camera.new_frame)
+            self.fill(FILL_TIMEOUT_S)
+            self.pool.take()
+
+    @contextlib.contextmanager
+    def paused(self):
+        """ Context manager giving the caller exclusive use of the camera
+        """
+        self._running.clear()
+        try:
+            with self._camera_lock:
+                yield
+        finally:
+            self._running.set()
+
+
+@attr.s(frozen=True, auto_attribs=True)
+class BurstResult:
+    """ Throughput of a single burst of pictures
+    """
+
+    requested: int
+    captured: int
+    dropped: int
+    """ Frames captured but discarded because the write queue was full """
+    elapsed_s: float
+
+    @property
+    def fps(self) -> float:
+        return self.captured / self.elapsed_s if self.elapsed_s else 0
@@ -1,6 +1,7 @@
 import typing as t
 from pathlib import Path
 import attr
+import cattr
 
 from . import constants, util
 
@@ -30,10 +31,80 @@ class Config:
     mouse_driver: str = "pitft"  # "TSLIB" if using resistive touchscreen
     mouse_device: Path = Path("/dev/input/touchscreen")
 
+    governor: bool = False
+    """ Lower preview resolution and camera framerate when the main loop can't keep up"""
+    governor_target_fps: float = 20
+    governor_resolutions: t.Tuple[t.Tuple[int, int], ...] = (
+        (320, 240),
+        (256, 192),
+        (160, 120),
+    )
+    governor_min_framerate: float = 10
+    governor_max_framerate: float = 30
+
     mock_camera: bool = False
+    mock_camera_fps: t.Optional[float] = None
+    """ Frame rate the mock camera is paced to (None for as fast as possible)"""
+    mock_camera_latency_s: float = 0
+    """ Extra delay the mock camera adds to every frame, for load testing"""
+    streaming_preview: bool = True
+    """ Keep the camera's video port recording continuously rather than capturing per frame"""
+    fixed_resolution_capture: bool = False
+    """ Keep the sensor at full resolution, resizing previews on the GPU, so that taking
+    a picture doesn't reconfigure the camera (limits the preview to 15 fps)"""
+    threaded_capture: bool = True
+    """ Fetch preview frames on a background thread so the main loop never waits on them"""
+    preview_format: str = "auto"
+    """ Camera pixel format for previews ("rgb", "rgba" or "bgra"), or "auto" to match the display"""
+    preview_buffers: int = 3
+    """ Number of preview frames rotated between the capture thread and the display (min 2)"""
+
+    write_behind: bool = True
+    """ Save photos on a background thread instead of blocking the viewfinder"""
+    write_queue_size: int = 8
+    """ Max number of encoded photos held in memory waiting to be written"""
+    fsync_policy: constants.FsyncPolicy = constants.FsyncPolicy.batch
 
     photo_storage_dir: Path = DEF_CAM_ROOT / "photos"
+    staging_dir: t.Optional[Path] = None
+    """ RAM-backed directory (e.g. under /dev/shm) where new photos wait to be moved to
+    photo_storage_dir, so SD card latency doesn't stall the shutter (None to disable)"""
+    staging_mb: float = 64
+    """ Max size of the photos waiting in staging_dir"""
+    photos_per_dir: t.Optional[int] = 1000
+    """ Split photos into numbered subdirectories of this many ids (None for a flat directory)"""
+    thumbnail_cache_mb: t.Optional[float] = 256
+    """ Disk space for screen-sized thumbnails used by the image viewer (None to disable)"""
+    image_cache_mb: float = 16
+    """ Memory for decoded photos kept by the image viewer"""
+    prefetch_images: int = 1
+    """ Number of photos on each side of the selected one to load in the background"""
+    photo_index: bool = True
+    """ Keep a persistent index of stored photos instead of listing the directory at startup"""
+    storage_reserve_mb: float = 64
+    """ Space to leave free on the photo filesystem; pictures are refused rather than fill it"""
+    storage_check_interval_s: float = 30
+    """ How often the free space estimate is checked against the filesystem"""
+    low_space_photos: int = 25
+    """ Warn when fewer than this many photos will fit"""
+    auto_downsize: bool = False
+    """ Step the picture size down once when space gets low"""
+    upload_backend: t.Optional[str] = None
+    """ Where to copy new photos: "local" (another directory), "volume" (a directory on
+    a removable or network volume) or "s3" (an S3-compatible object store). None to disable"""
+    upload_dir: t.Optional[Path] = None
+    """ Destination for the "local" and "volume" backends"""
+    upload_s3_bucket: t.Optional[str] = None
+    upload_s3_prefix: str = ""
+    upload_s3_endpoint: t.Optional[str] = None
+    """ URL of the object store, e.g. a MinIO server (None for AWS)"""
+    upload_part_mb: float = 8
+    """ Photos larger than this are uploaded to S3 in parts of this size (min 5)"""
+    upload_kbps: t.Optional[float] = None
+    """ Bandwidth limit for uploads, in KiB/s (None for unlimited)"""
     settings_cache: Path = DEF_CAM_ROOT / "settings.json"
+    settings_save_interval_s: float = 5
+    """ Changed settings are written at most this often"""
 
     uid: int = attr.ib(factory=util.get_uid)
     gid: int = attr.ib(factory=util.get_gid)
@@ -44,10 +115,17 @@ class Settings:
     """ Mutable user-defined settings that are preserved between sessions
     """
 
-    next_photo_idx: int = None
+    next_photo_idx: t.Optional[int] = None
     draw_fps: bool = True
     size_mode: constants.SizeMode = constants.SizeMode.lg
     fx_mode: constants.Fx = constants.Fx.none
     iso_mode: constants.IsoSetting = constants.ISO_DATA["auto"]
     snap_pause_time: float = 2.5
+    burst_frames: int = 10
     jpg_quality: float = 0.85
+
+
+# ISO settings are stored by value; restore the shared instance
+cattr.register_structure_hook(
+    constants.IsoSetting, lambda data, _: constants.ISO_DATA[data["iso"]]
+)
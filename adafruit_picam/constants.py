@@ -24,6 +24,7 @@ class Intention(Enum):
     confirm_delete = "confirm_delete"
 
     take_picture = "take_picture"
+    burst = "burst"
 
     switch_mode = "switch_mode"
 
@@ -71,6 +72,18 @@ class Fx(Enum):
     solarize = "solarize"
 
 
+class FsyncPolicy(Enum):
+    """ When written photos are forced to disk before they're considered saved
+    """
+
+    never = "never"
+    """ Leave it to the OS; a power cut can lose recent photos """
+    always = "always"
+    """ fsync every photo as it's written """
+    batch = "batch"
+    """ sync once whenever the write queue empties """
+
+
 #######################
 # Image size settings #
 #######################
@@ -1,5 +1,4 @@
 import typing as t
-from pathlib import Path
 
 import attr
 import pygame
@@ -28,22 +27,29 @@ class Icon:
     image (PNG loaded from icons directory) for each.
     There isn't a globally-declared fixed list of Icons.  Instead, the list
     is populated at runtime from the contents of the 'icons' directory.
+    The image isn't decoded until it's first drawn, so icons that are never
+    shown cost nothing at startup.
     """
 
     REGISTRY: t.ClassVar[t.Dict[str, "Icon"]] = {}
 
     name: str
-    bitmap: pygame.Surface
+    loader: t.Callable[[], pygame.Surface] = attr.ib(eq=False, repr=False)
+    """ Decodes the image, converted to the display's pixel format """
+    _bitmap: t.Optional[pygame.Surface] = attr.ib(
+        default=None, init=False, eq=False, repr=False
+    )
 
     def __attrs_post_init__(self):
         assert self.name not in self.REGISTRY
         self.REGISTRY[self.name] = self
 
-    @classmethod
-    def load(cls: t.Type[K], path: Path) -> K:
-        name = path.with_suffix("").name
-        bitmap = pygame.image.load(str(path))
-        return Icon(name, bitmap)
+    @property
+    def bitmap(self) -> pygame.Surface:
+        if self._bitmap is None:
+            # a cache, not part of the icon's value, so frozen doesn't apply
+            object.__setattr__(self, "_bitmap", self.loader())
+        return self._bitmap
 
     @classmethod
     def get(cls: t.Type[T], name: t.Optional[str]) -> t.Optional[T]:
@@ -56,6 +62,21 @@ class Icon:
             return None
 
 
+def display_format(bitmap: pygame.Surface) -> pygame.Surface:
+    """ Convert ``bitmap`` to the display's pixel format, so blits don't have to
+
+    Images with per-pixel alpha keep it. Colour-keyed images are RLE encoded, which
+    lets SDL skip transparent runs instead of testing every pixel.
+    """
+    if bitmap.get_flags() & pygame.SRCALPHA:
+        return bitmap.convert_alpha()
+    colorkey = bitmap.get_colorkey()
+    bitmap = bitmap.convert()
+    if colorkey is not None:
+        bitmap.set_colorkey(colorkey, pygame.RLEACCEL)
+    return bitmap
+
+
 @attr.s(frozen=True, auto_attribs=True)
 class Button:
     """
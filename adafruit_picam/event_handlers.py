@@ -1,7 +1,10 @@
+import io
+import time
 import typing as t
 
 from . import root_logger
-from .constants import Intention, ScreenMode
+from .capture import BurstResult
+from .constants import FsyncPolicy, Intention, ScreenMode
 from . import constants
 
 if t.TYPE_CHECKING:
@@ -49,32 +52,90 @@ def switch_mode(state: "State", new_mode: ScreenMode):
 #############################
 @_handler(Intention.take_picture)
 def take_picture(state: "State", _):
-    if state.image_ids:
-        target_id = state.image_ids[-1] + 1
-    else:
-        target_id = 0
-    with state.storage.write_image(target_id) as stream:
-        state.camera.write_picture(stream, state.settings)
+    if state.photos_left() == 0:
+        LOGGER.error("Not enough free space to take a picture")
+        return
+    target_id = state.allocate_image_id()
+    if state.cfg.write_behind:
+        # encode into memory and hand off; the viewfinder resumes right away
+        with io.BytesIO() as stream:
+            with state.camera_access():
+                state.camera.write_picture(stream, state.settings)
+            data = stream.getvalue()
+        state.record_photo(len(data))
+        state.writer.submit(target_id, data, block=True)
+        LOGGER.info(f"New picture queued: {target_id}")
+        return
+
+    fsync = state.cfg.fsync_policy is not FsyncPolicy.never
+    with state.storage.write_image(target_id, fsync=fsync) as stream:
+        with state.camera_access():
+            state.camera.write_picture(stream, state.settings)
+        state.record_photo(stream.tell())
+    state.storage.publish(target_id)
     LOGGER.info(f"New picture: {target_id}")
-    state.selected_image_index = -1
-    state.image_ids.add(target_id)
+    state.selected_image_id = target_id
     state.took_picture = True
 
 
+@_handler(Intention.burst)
+def burst(state: "State", count: t.Optional[int]):
+    """ Capture ``count`` pictures (default: ``settings.burst_frames``) back-to-back
+
+    Encoded frames are queued for the background writer while capture continues; if
+    the writer falls behind and its queue fills up, frames are dropped. The burst is
+    cut short if it wouldn't fit in the remaining free space.
+    """
+    count = count or state.settings.burst_frames
+    left = state.photos_left()
+    if left is not None and left < count:
+        LOGGER.warning(f"Only enough free space for {left} of {count} burst frames")
+        count = left
+    if count == 0:
+        return
+    captured = 0
+    dropped = 0
+
+    def outputs() -> t.Iterator[io.BytesIO]:
+        nonlocal captured, dropped
+        for _ in range(count):
+            stream = io.BytesIO()
+            yield stream  # resumes once the picture is in the stream
+            captured += 1
+            data = stream.getvalue()
+            state.record_photo(len(data))
+            if state.writer.submit(state.next_image_id, data):
+                state.allocate_image_id()
+            else:
+                dropped += 1
+
+    start = time.monotonic()
+    with state.camera_access():
+        state.camera.write_burst(outputs(), state.settings)
+    elapsed = time.monotonic() - start
+
+    state.last_burst = BurstResult(count, captured, dropped, elapsed)
+    LOGGER.info(
+        f"Burst: {captured}/{count} frames in {elapsed:.2f}s "
+        f"({state.last_burst.fps:.1f} fps), {dropped} dropped"
+    )
+
+
 #############################
 # Image viewer handlers     #
 #############################
 @_handler(Intention.inc_image)
 def increment_image(state: "State", increment: int):
-    new_idx = (state.selected_image_index + increment) % len(state.image_ids)
-    state.selected_image_index = new_idx
+    state.selected_image_id = state.storage.viewable_ids.neighbour(
+        state.selected_image_id, increment
+    )
     state.load_image()
 
 
 @_handler(Intention.delete_image)
 def delete_image(state: "State", _):
-    image_id = state.image_ids[state.selected_image_index]
-    state.storage.delete_image(image_id)
+    state.storage.delete_image(state.selected_image_id)
+    state.clamp_selection()
 
 
 @_handler(Intention.inc_setting)
@@ -84,6 +145,30 @@ def cycle_settings_view(state: "State", increment: int):
     switch_mode(state, new_mode)
 
 
+#############################
+# Camera settings handlers  #
+#############################
+@_handler(Intention.set_image_size)
+def set_image_size(state: "State", size_mode: constants.SizeMode):
+    state.settings.size_mode = size_mode
+    state.settings_changed()
+
+
+@_handler(Intention.inc_effect)
+def change_effect(state: "State", increment: int):
+    effects = list(constants.Fx)
+    idx = (effects.index(state.settings.fx_mode) + increment) % len(effects)
+    state.settings.fx_mode = effects[idx]
+    with state.camera_access():
+        state.camera.set_fx_mode(state.settings.fx_mode)
+    state.settings_changed()
+
+
 @_handler(Intention.inc_iso)
-def change_iso():
-    raise NotImplementedError()
+def change_iso(state: "State", increment: int):
+    isos = list(constants.ISO_DATA.values())
+    idx = (isos.index(state.settings.iso_mode) + increment) % len(isos)
+    state.settings.iso_mode = isos[idx]
+    with state.camera_access():
+        state.camera.set_iso_mode(state.settings.iso_mode)
+    state.settings_changed()
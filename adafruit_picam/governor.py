@@ -0,0 +1,133 @@
+import contextlib
+import time
+import typing as t
+
+import attr
+
+from . import root_logger
+from .config import Config
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("governor")
+
+SMOOTHING = 0.2
+""" Weight of the newest sample in each stage's moving average """
+STEP_DOWN_FPS = 0.9
+STEP_DOWN_LOAD = 0.8
+""" Only step down if the loop's stages take at least this fraction of the frame budget;
+otherwise the time goes elsewhere, and a smaller preview wouldn't help """
+STEP_UP_FPS = 1.1
+STEP_UP_LOAD = 0.6
+""" Only step up if the loop's stages take less than this fraction of the frame budget """
+FRAMERATE_STEP = 0.75
+
+
+@attr.s(auto_attribs=True)
+class Governor:
+    """ Adjusts preview resolution and camera framerate to keep the main loop at ``target_fps``
+
+    When the frame budget is missed because of the loop's timed stages, the camera
+    framerate is reduced first and then the preview resolution; with headroom to spare,
+    they're restored in reverse order.
+    """
+
+    target_fps: float
+    resolutions: t.Sequence[t.Tuple[int, int]]
+    """ Allowed preview resolutions, largest first """
+    min_framerate: float
+    max_framerate: float
+    window: int
+    """ Frames to wait between adjustments, so each one has time to take effect """
+
+    res_index: int = 0
+    framerate: float = None
+    stage_times: t.Dict[str, float] = attr.ib(factory=dict)
+    """ Moving average of the time spent in each stage of the loop, in seconds """
+    frames_since_change: int = 0
+
+    @classmethod
+    def initialize(
+        cls: t.Type[T], cfg: Config, camera_max_framerate: t.Optional[float] = None
+    ) -> T:
+        """
+        Args:
+            camera_max_framerate: fastest preview the camera will deliver, if it's
+                slower than ``cfg.governor_max_framerate``
+        """
+        max_framerate = cfg.governor_max_framerate
+        if camera_max_framerate is not None:
+            max_framerate = min(max_framerate, camera_max_framerate)
+        return cls(
+            target_fps=cfg.governor_target_fps,
+            resolutions=cfg.governor_resolutions,
+            min_framerate=min(cfg.governor_min_framerate, max_framerate),
+            max_framerate=max_framerate,
+            window=cfg.fps_window,
+            framerate=max_framerate,
+        )
+
+    @property
+    def resolution(self) -> t.Tuple[int, int]:
+        return self.resolutions[self.res_index]
+
+    @property
+    def load(self) -> float:
+        """ Fraction of the frame budget spent in the loop's stages """
+        return sum(self.stage_times.values()) * self.target_fps
+
+    def record(self, stage: str, seconds: float):
+        prev = self.stage_times.get(stage, seconds)
+        self.stage_times[stage] = prev + SMOOTHING * (seconds - prev)
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        """ Context manager that records how long its body takes as ``stage``
+        """
+        start = time.perf_counter()
+        yield
+        self.record(stage, time.perf_counter() - start)
+
+    def update(self, fps: float) -> t.Optional[t.Tuple[t.Tuple[int, int], float]]:
+        """ To be called once each frame.
+
+        Returns:
+            The new (resolution, framerate) for the preview, or None if nothing changes
+        """
+        self.frames_since_change += 1
+        if self.frames_since_change < self.window:
+            return None
+
+        if fps < self.target_fps * STEP_DOWN_FPS and self.load >= STEP_DOWN_LOAD:
+            changed = self._step_down()
+        elif fps > self.target_fps * STEP_UP_FPS and self.load < STEP_UP_LOAD:
+            changed = self._step_up()
+        else:
+            changed = False
+
+        if not changed:
+            return None
+        self.frames_since_change = 0
+        LOGGER.info(
+            f"{fps:.1f} fps, load {self.load:.0%}: preview -> "
+            f"{self.resolution[0]}x{self.resolution[1]} @ {self.framerate:g} fps"
+        )
+        return self.resolution, self.framerate
+
+    def _step_down(self) -> bool:
+        if self.framerate > self.min_framerate:
+            self.framerate = max(self.min_framerate, self.framerate * FRAMERATE_STEP)
+        elif self.res_index < len(self.resolutions) - 1:
+            self.res_index += 1
+        else:
+            return False
+        return True
+
+    def _step_up(self) -> bool:
+        if self.res_index > 0:
+            self.res_index -= 1
+        elif self.framerate < self.max_framerate:
+            self.framerate = min(self.max_framerate, self.framerate / FRAMERATE_STEP)
+        else:
+            return False
+        return True
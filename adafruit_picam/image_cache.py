@@ -0,0 +1,138 @@
+import contextlib
+import threading
+import typing as t
+from collections import OrderedDict
+
+import attr
+import pygame
+
+from . import root_logger
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("imgcache")
+
+JOIN_TIMEOUT_S = 5.0
+
+_IDLE = object()
+""" `ImageCache._loading` while the prefetch thread isn't loading anything """
+
+
+def surface_bytes(img: pygame.Surface) -> int:
+    return img.get_pitch() * img.get_height()
+
+
+@attr.s(auto_attribs=True)
+class ImageCache:
+    """ Least-recently-used cache of decoded photos for the image viewer
+
+    A background thread loads photos requested with `prefetch`, so that stepping
+    to a neighbouring photo doesn't have to wait for it to be decoded. The cache
+    holds at most ``budget_bytes`` of pixels, but always keeps the newest entry.
+    """
+
+    load: t.Callable[[int], pygame.Surface]
+    budget_bytes: int
+
+    _surfaces: "OrderedDict[int, pygame.Surface]" = attr.ib(factory=OrderedDict)
+    _total_bytes: int = 0
+    _wanted: t.List[int] = attr.ib(factory=list)
+    """ Ids to prefetch, most important first """
+    _loading: t.Union[int, object] = _IDLE
+    """ Id the prefetch thread is currently loading, or `_IDLE` """
+    _cancelled: bool = False
+    _stop: bool = False
+    _cond: threading.Condition = attr.ib(factory=threading.Condition)
+    _thread: t.Optional[threading.Thread] = None
+
+    @classmethod
+    def start(
+        cls: t.Type[T], load: t.Callable[[int], pygame.Surface], budget_bytes: int
+    ) -> T:
+        cache = cls(load, budget_bytes)
+        cache._thread = threading.Thread(
+            target=cache.run, name="prefetch", daemon=True
+        )
+        cache._thread.start()
+        return cache
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        """ Context manager that stops the prefetch thread on exit
+        """
+        yield
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join(timeout=JOIN_TIMEOUT_S)
+
+    def get(self, imgid: int) -> pygame.Surface:
+        """ Return photo ``imgid``, loading it now if it isn't cached
+        """
+        with self._cond:
+            # if it's being prefetched, that's quicker than starting over
+            self._cond.wait_for(lambda: self._loading != imgid)
+            if imgid in self._surfaces:
+                self._surfaces.move_to_end(imgid)
+                return self._surfaces[imgid]
+
+        img = self.load(imgid)
+        with self._cond:
+            self._insert(imgid, img)
+        return img
+
+    def prefetch(self, imgids: t.Sequence[int]):
+        """ Replace the list of photos to load in the background
+        """
+        with self._cond:
+            self._wanted = [i for i in imgids if i not in self._surfaces]
+            self._cond.notify_all()
+
+    def discard(self, imgid: int):
+        """ Forget photo ``imgid``, e.g. because it was deleted
+        """
+        with self._cond:
+            if imgid in self._surfaces:
+                self._total_bytes -= surface_bytes(self._surfaces.pop(imgid))
+            if imgid in self._wanted:
+                self._wanted.remove(imgid)
+            if self._loading == imgid:
+                self._cancelled = True
+
+    def photos_changed(self, added: t.List[int], removed: t.List[int]):
+        """ `PhotoIds` listener that drops deleted photos """
+        for imgid in removed:
+            self.discard(imgid)
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or self._wanted)
+                if self._stop:
+                    return
+                imgid = self._wanted.pop(0)
+                if imgid in self._surfaces:
+                    continue
+                self._loading = imgid
+                self._cancelled = False
+
+            try:
+                img = self.load(imgid)
+            except Exception:
+                LOGGER.warning(f"Failed to prefetch image {imgid}", exc_info=True)
+                img = None
+
+            with self._cond:
+                if img is not None and not self._cancelled:
+                    self._insert(imgid, img)
+                self._loading = _IDLE
+                self._cond.notify_all()
+
+    def _insert(self, imgid: int, img: pygame.Surface):
+        if imgid in self._surfaces:
+            self._total_bytes -= surface_bytes(self._surfaces.pop(imgid))
+        self._surfaces[imgid] = img
+        self._total_bytes += surface_bytes(img)
+        while self._total_bytes > self.budget_bytes and len(self._surfaces) > 1:
+            _, evicted = self._surfaces.popitem(last=False)
+            self._total_bytes -= surface_bytes(evicted)
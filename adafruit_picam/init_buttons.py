@@ -99,6 +99,7 @@ def viewfinder_buttons():
             on_click=Intention.switch_mode,
             value=ScreenMode.image_viewer,
         ),
+        Button.load(rect=(242, 0, 78, 52), bg_name="burst", on_click=Intention.burst),
         Button.load(
             name="viewfinder", rect=(0, 0, 320, 240), on_click=Intention.take_picture,
         ),
@@ -149,7 +150,7 @@ def effects_buttons():
             on_click=Intention.inc_effect,
             value=1,
         ),
-        Button.load(rect=(0, 67, 320, 91), bg_name="fx-none"),
+        Button.load(name="fx_mode", rect=(0, 67, 320, 91), bg_name="fx-none"),
         Button.load(rect=(0, 11, 320, 29), bg_name="fx"),
         *_settings_nav(),
     ]
@@ -160,7 +161,7 @@ def iso_buttons():
         Button.load(
             rect=(240, 70, 80, 52), bg_name="next", on_click=Intention.inc_iso, value=1,
         ),
-        Button.load(rect=(0, 79, 320, 33), bg_name="iso-0"),
+        Button.load(name="iso_mode", rect=(0, 79, 320, 33), bg_name="iso-0"),
         Button.load(rect=(9, 134, 302, 26), bg_name="iso-bar"),
         Button.load(rect=(17, 157, 21, 19), bg_name="iso-arrow"),
         Button.load(rect=(0, 10, 320, 29), bg_name="iso"),
@@ -31,6 +31,7 @@ from . import root_logger
 from . import config, util
 from .event_handlers import handle_event
 from .state import State
+from .storage import Storage
 from .ui import UI
 
 LOGGER = root_logger.getChild("main")
@@ -52,12 +53,38 @@ def entrypoint(cfg_path: Path = config.DEF_CONFIG_PATH, loglevel: str = "warning
         cfg_path: Path to config file (default: {config.DEF_CONFIG_PATH})
     """
     root_logger.setLevel(loglevel.upper())
+    main(load_config(cfg_path))
+
+
+@click.command("adapicam-reindex")
+@click.option(
+    "-c",
+    "--config",
+    "cfg_path",
+    help="Path to config file",
+    default=str(config.DEF_CONFIG_PATH),
+    show_default=True,
+)
+def rebuild_index(cfg_path: Path = config.DEF_CONFIG_PATH):
+    """ Rebuild the photo index from the contents of the photo directory.
+
+    Use this if the index is missing or corrupt. The camera must not be running.
+    """
+    cfg = load_config(cfg_path)
+    # a bare Storage: initialize would scan the photos a second time, and start staging
+    storage = Storage(
+        cfg.settings_cache, cfg.photo_storage_dir, shard_size=cfg.photos_per_dir
+    )
+    ids = storage.rebuild_index()
+    click.echo(f"Indexed {len(ids)} photos in {cfg.photo_storage_dir}")
+
+
+def load_config(cfg_path: Path) -> config.Config:
     try:
-        cfg = util.load_json(config.Config, cfg_path)
+        return util.load_json(config.Config, Path(cfg_path))
     except FileNotFoundError:
         LOGGER.warning(f"No config file found at {cfg_path}; using defaults")
-        cfg = config.Config()
-    main(cfg)
+        return config.Config()
 
 
 def main(cfg: config.Config):
@@ -66,8 +93,11 @@ def main(cfg: config.Config):
     LOGGER.critical("startup")
     LOGGER.info(f"Config: {cfg}")
 
-    state = State.initialize(cfg)
+    # the UI comes first so the camera can deliver frames in the display's format
     ui = UI.initialize(cfg)
+    state = State.initialize(cfg, pixel_format=ui.preview_format)
+    ui.sync_buttons(state.settings)
+    state.subscribe_settings(ui.sync_buttons)
 
     try:
         if cfg.splash_img_path and cfg.splash_img_path.is_file():
@@ -100,9 +130,11 @@ def run_forever(ui: UI, state: State):
 
     while not state.shutdown:
         fps = state.fps_tick()
+        state.poll_background()
 
         # react to user input events
-        event = ui.get_event(state.screen_mode)
+        with state.timed("input"):
+            event = ui.get_event(state.screen_mode)
         if event is not None:
             LOGGER.debug(f"Event: {event}")
             handle_event(state, event)
@@ -110,12 +142,19 @@ def run_forever(ui: UI, state: State):
         # need some sort of lockout or debounce
 
         # draw screen
-        img = state.get_display_image()
+        with state.timed("capture"):
+            img, live = state.get_display_image()
         if state.took_picture:
-            ui.redraw(img, mode=None)
+            ui.redraw(img, mode=None, live=live)
             time.sleep(state.settings.snap_pause_time)
             state.took_picture = False
         else:
-            ui.redraw(
-                img, state.screen_mode, fps=fps if state.settings.draw_fps else None
-            )
+            with state.timed("draw"):
+                ui.redraw(
+                    img,
+                    state.screen_mode,
+                    live=live,
+                    fps=fps if state.settings.draw_fps else None,
+                    warning=state.storage_warning,
+                )
+            state.govern(fps)
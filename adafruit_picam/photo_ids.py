@@ -0,0 +1,156 @@
+import array
+import bisect
+import contextlib
+import threading
+import typing as t
+
+import attr
+
+T = t.TypeVar("T")
+
+Listener = t.Callable[[t.List[int], t.List[int]], None]
+""" Called with the ids that were (added, removed) """
+
+COMPACT_SLACK = 1024
+""" Dead slots are swept out once there are more than this many, or more than live ids """
+
+
+@attr.s(auto_attribs=True)
+class PhotoIds:
+    """ The sorted set of stored photo ids
+
+    Ids are kept in a compact ``array`` (8 bytes per photo) with a flag per slot
+    marking whether it's live. Removing an id only clears its flag, so bulk deletes
+    are cheap; dead slots are swept out once there are enough of them. New photos
+    get the highest id so far, which makes adding one an append.
+
+    Listeners are called after every change, on the thread that made it and with
+    the lock held, so they see changes in order but must be quick. All methods
+    are thread-safe.
+    """
+
+    _ids: array.array = attr.ib(factory=lambda: array.array("q"))
+    _alive: bytearray = attr.ib(factory=bytearray)
+    _count: int = 0
+    """ Number of live ids """
+    _listeners: t.List[Listener] = attr.ib(factory=list)
+    _lock: threading.RLock = attr.ib(factory=threading.RLock)
+
+    @classmethod
+    def from_ids(cls: t.Type[T], imgids: t.Iterable[int]) -> T:
+        ordered = sorted(set(imgids))
+        return cls(
+            array.array("q", ordered), bytearray([1]) * len(ordered), len(ordered)
+        )
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, imgid: int) -> bool:
+        with self._lock:
+            return self._find(imgid) is not None
+
+    def snapshot(self) -> t.Set[int]:
+        with self._lock:
+            return {i for i, alive in zip(self._ids, self._alive) if alive}
+
+    def first(self) -> t.Optional[int]:
+        with self._lock:
+            for pos in range(len(self._ids)):
+                if self._alive[pos]:
+                    return self._ids[pos]
+        return None
+
+    def last(self) -> t.Optional[int]:
+        with self._lock:
+            for pos in reversed(range(len(self._ids))):
+                if self._alive[pos]:
+                    return self._ids[pos]
+        return None
+
+    def neighbour(self, imgid: int, step: int) -> t.Optional[int]:
+        """ The id ``step`` places after ``imgid`` (before, if negative), wrapping around
+
+        ``imgid`` needn't be stored; e.g. after it's deleted, a step of 1 gives the
+        photo that followed it. Returns None if there are no ids.
+        """
+        assert step != 0
+        with self._lock:
+            if not self._count:
+                return None
+            pos = bisect.bisect_left(self._ids, imgid)
+            if step > 0 and self._find(imgid) is None:
+                # a missing id sits between pos - 1 and pos
+                pos -= 1
+            direction = 1 if step > 0 else -1
+            remaining = (abs(step) - 1) % self._count + 1
+            n = len(self._ids)
+            while remaining:
+                pos = (pos + direction) % n
+                if self._alive[pos]:
+                    remaining -= 1
+            return self._ids[pos]
+
+    @contextlib.contextmanager
+    def frozen(self):
+        """ Context manager that holds off changes until it exits
+        """
+        with self._lock:
+            yield
+
+    def subscribe(self, listener: Listener):
+        with self._lock:
+            self._listeners.append(listener)
+
+    def add(self, *imgids: int):
+        with self._lock:
+            added = [i for i in imgids if self._insert(i)]
+            self._notify(added, [])
+
+    def remove(self, *imgids: int):
+        with self._lock:
+            removed = []
+            for imgid in imgids:
+                pos = self._find(imgid)
+                if pos is not None:
+                    self._alive[pos] = 0
+                    self._count -= 1
+                    removed.append(imgid)
+            dead = len(self._ids) - self._count
+            if dead > COMPACT_SLACK or dead > self._count:
+                self._compact()
+            self._notify([], removed)
+
+    def _find(self, imgid: int) -> t.Optional[int]:
+        """ Position of live id ``imgid``, or None """
+        pos = bisect.bisect_left(self._ids, imgid)
+        if pos < len(self._ids) and self._ids[pos] == imgid and self._alive[pos]:
+            return pos
+        return None
+
+    def _insert(self, imgid: int) -> bool:
+        if not self._ids or imgid > self._ids[-1]:
+            self._ids.append(imgid)
+            self._alive.append(1)
+        else:
+            pos = bisect.bisect_left(self._ids, imgid)
+            if self._ids[pos] == imgid:
+                if self._alive[pos]:
+                    return False
+                self._alive[pos] = 1
+            else:
+                self._ids.insert(pos, imgid)
+                self._alive.insert(pos, 1)
+        self._count += 1
+        return True
+
+    def _compact(self):
+        self._ids = array.array(
+            "q", [i for i, alive in zip(self._ids, self._alive) if alive]
+        )
+        self._alive = bytearray([1]) * len(self._ids)
+
+    def _notify(self, added: t.List[int], removed: t.List[int]):
+        if added or removed:
+            for listener in self._listeners:
+                listener(added, removed)
@@ -0,0 +1,120 @@
+import os
+import threading
+import typing as t
+from pathlib import Path
+
+import attr
+
+from . import root_logger
+from .photo_ids import PhotoIds
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("index")
+
+INDEX_NAME = ".photo_index"
+HEADER = "adacam-photo-index 1\n"
+
+COMPACT_RATIO = 2
+COMPACT_SLACK = 1000
+""" The log is compacted once it has this many more records than COMPACT_RATIO * ids """
+
+
+class CorruptIndex(ValueError):
+    pass
+
+
+@attr.s(auto_attribs=True)
+class PhotoIndex:
+    """ Append-only log of the photo ids stored in a directory
+
+    Each line records one id being added (``+<id>``) or removed (``-<id>``), so
+    loading it is a single sequential read no matter how the photos are laid
+    out on disk. It is periodically compacted into a list of just the live ids.
+
+    The log follows the changes made to ``ids``. All methods are thread-safe.
+    """
+
+    path: Path
+    ids: PhotoIds
+    records: int = 0
+    """ Number of records in the log """
+    _lock: threading.Lock = attr.ib(factory=threading.Lock)
+
+    def __attrs_post_init__(self):
+        self.ids.subscribe(self.photos_changed)
+
+    @classmethod
+    def load(cls: t.Type[T], path: Path) -> T:
+        """ Read an existing index
+
+        Raises:
+            FileNotFoundError: if there's no index at ``path``
+            CorruptIndex: if it can't be parsed
+        """
+        ids = set()
+        records = 0
+        truncated = False
+        with path.open("r") as stream:
+            if stream.readline() != HEADER:
+                raise CorruptIndex(f"{path} has an unknown header")
+            for line in stream:
+                if not line.endswith("\n"):
+                    # interrupted while appending; the directory scan will catch it up
+                    truncated = True
+                    break
+                try:
+                    imgid = int(line[1:])
+                except ValueError:
+                    raise CorruptIndex(f"Bad record in {path}: {line!r}")
+                if line[0] == "+":
+                    ids.add(imgid)
+                elif line[0] == "-":
+                    ids.discard(imgid)
+                else:
+                    raise CorruptIndex(f"Bad record in {path}: {line!r}")
+                records += 1
+
+        index = cls(path, PhotoIds.from_ids(ids), records)
+        if truncated:
+            LOGGER.warning(f"Dropped truncated final record from {path}")
+            index.compact()
+        return index
+
+    @classmethod
+    def create(cls: t.Type[T], path: Path, ids: t.Iterable[int]) -> T:
+        """ Write a new index at ``path`` containing ``ids``, replacing any existing one
+        """
+        index = cls(path, PhotoIds.from_ids(ids))
+        index.compact()
+        return index
+
+    def photos_changed(self, added: t.List[int], removed: t.List[int]):
+        """ `PhotoIds` listener that appends the change to the log """
+        with self._lock:
+            lines = [f"+{imgid}\n" for imgid in added]
+            lines.extend(f"-{imgid}\n" for imgid in removed)
+            with self.path.open("a") as stream:
+                stream.writelines(lines)
+            self.records += len(lines)
+
+            if self.records > COMPACT_RATIO * len(self.ids) + COMPACT_SLACK:
+                self._compact()
+
+    def compact(self):
+        """ Atomically rewrite the log as just the live ids
+        """
+        # same lock order as a change notification
+        with self.ids.frozen(), self._lock:
+            self._compact()
+
+    def _compact(self):
+        live = sorted(self.ids.snapshot())
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with tmp.open("w") as stream:
+            stream.write(HEADER)
+            stream.writelines(f"+{imgid}\n" for imgid in live)
+            stream.flush()
+            os.fsync(stream.fileno())
+        os.replace(str(tmp), str(self.path))
+        self.records = len(live)
@@ -0,0 +1,224 @@
+import contextlib
+import itertools
+import os
+import shutil
+import threading
+import typing as t
+from collections import OrderedDict
+from pathlib import Path
+
+import attr
+
+from . import root_logger
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("staging")
+
+JOIN_TIMEOUT_S = 30.0
+ROOM_TIMEOUT_S = 5.0
+""" How long a write waits for space in staging before going straight to the card """
+FLUSH_DELAY_S = 2.0
+""" How long the flusher waits for more photos (e.g. the rest of a burst) before a flush """
+RETRY_S = 10.0
+BATCH_SIZE = 16
+""" Max photos moved per sync """
+TMP_SUFFIX = ".tmp"
+
+
+@attr.s(auto_attribs=True)
+class StagingArea:
+    """ RAM-backed directory where new photos wait to be moved to the photo directory
+
+    A background thread copies staged photos to their final location in batches,
+    syncing once per batch, then renames them into place and removes them from
+    staging. A photo is readable from one location or the other throughout, but
+    is only published once it's durable in its final location.
+    Photos left in staging by a crash are picked up again at startup, and copies it
+    interrupted are removed from ``photo_dir``.
+    """
+
+    directory: Path
+    budget_bytes: int
+    photo_dir: Path
+    """ Where `destination` puts photos, directly or one subdirectory down """
+    destination: t.Callable[[int], Path]
+    """ Final location of each photo """
+    published: t.Callable[..., None]
+    """ Called with the ids of each batch once it's durable in its final location """
+    error: t.Optional[BaseException] = None
+
+    lock: threading.RLock = attr.ib(factory=threading.RLock)
+    """ Held while photos are moved out of staging; hold it to delete one """
+    _pending: "OrderedDict[int, int]" = attr.ib(factory=OrderedDict)
+    """ Size of each staged photo, oldest first """
+    _staged_bytes: int = 0
+    _stop: bool = False
+    _cond: threading.Condition = attr.ib(factory=threading.Condition)
+    _thread: t.Optional[threading.Thread] = None
+
+    @classmethod
+    def initialize(
+        cls: t.Type[T],
+        directory: Path,
+        budget_bytes: int,
+        photo_dir: Path,
+        destination: t.Callable[[int], Path],
+        published: t.Callable[..., None],
+    ) -> T:
+        staging = cls(directory, budget_bytes, photo_dir, destination, published)
+        staging.directory.mkdir(parents=True, exist_ok=True)
+        staging._recover()
+        staging._thread = threading.Thread(
+            target=staging.run, name="flusher", daemon=True
+        )
+        staging._thread.start()
+        return staging
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        """ Context manager that moves everything out of staging on exit
+        """
+        yield
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._thread.join(timeout=JOIN_TIMEOUT_S)
+        if self._thread.is_alive():
+            LOGGER.error(
+                f"flusher failed to finish; photos left in {self.directory} "
+                "will be moved at the next startup"
+            )
+
+    def path(self, imgid: int) -> Path:
+        return self.directory / self.destination(imgid).name
+
+    def staged_ids(self) -> t.List[int]:
+        with self._cond:
+            return list(self._pending)
+
+    def wait_for_room(self, timeout: float = ROOM_TIMEOUT_S) -> bool:
+        """ Wait until staging is below its budget
+
+        Returns:
+            bool: False if it's still full after ``timeout``
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._staged_bytes < self.budget_bytes, timeout
+            )
+
+    def add(self, imgid: int, nbytes: int):
+        """ Queue a photo that's been written to `path` for moving
+        """
+        with self._cond:
+            self._pending[imgid] = nbytes
+            self._staged_bytes += nbytes
+            self._cond.notify_all()
+
+    def discard(self, imgid: int):
+        """ Stop tracking a staged photo, because it's being deleted. Hold `lock`.
+        """
+        with self._cond:
+            self._staged_bytes -= self._pending.pop(imgid, 0)
+            self._cond.notify_all()
+
+    def run(self):
+        # copies are only made by this thread, so none can be in progress yet
+        self._remove_stale_copies()
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                self._flush(batch)
+            except Exception as exc:
+                LOGGER.error("Failed to move photos out of staging", exc_info=True)
+                self.error = exc
+                with self._cond:
+                    if self._stop:
+                        return
+                    self._cond.wait(RETRY_S)
+
+    def _next_batch(self) -> t.List[int]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._stop or self._pending)
+            # give the rest of a burst a chance to land, so it's flushed together
+            self._cond.wait_for(
+                lambda: self._stop
+                or len(self._pending) >= BATCH_SIZE
+                or self._staged_bytes >= self.budget_bytes / 2,
+                FLUSH_DELAY_S,
+            )
+            return list(self._pending)[:BATCH_SIZE]
+
+    def _flush(self, batch: t.List[int]):
+        copied = []
+        for imgid in batch:
+            src = self.path(imgid)
+            dest = self.destination(imgid)
+            tmp = dest.with_suffix(TMP_SUFFIX)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                shutil.copy(str(src), str(tmp))
+            except FileNotFoundError:  # deleted since it was queued
+                continue
+            copied.append((imgid, src, tmp, dest))
+        os.sync()
+
+        moved = []
+        with self.lock:
+            for imgid, src, tmp, dest in copied:
+                if src.exists():
+                    os.replace(str(tmp), str(dest))
+                    src.unlink()
+                    moved.append(imgid)
+                else:  # deleted while it was being copied
+                    tmp.unlink()
+            with self._cond:
+                for imgid in batch:
+                    self._staged_bytes -= self._pending.pop(imgid, 0)
+                self._cond.notify_all()
+        # the renames have to reach the card too before anyone relies on the photos
+        os.sync()
+        self.published(*moved)
+        LOGGER.debug(f"Moved {len(moved)} photos out of staging")
+
+    def _recover(self):
+        """ Queue photos left behind by a crash """
+        for entry in os.scandir(str(self.directory)):
+            name = Path(entry.name)
+            if name.name.startswith("IMG_") and name.suffix == ".JPG":
+                try:
+                    imgid = int(name.stem[4:])
+                except ValueError:
+                    continue
+                self.add(imgid, entry.stat().st_size)
+        if self._pending:
+            LOGGER.warning(
+                f"{len(self._pending)} photos were left in {self.directory}; "
+                "moving them to the photo directory"
+            )
+
+    def _remove_stale_copies(self):
+        """ Remove copies to `destination` that a crash interrupted
+
+        Their staged originals may be gone (staging is usually a tmpfs), so they're
+        found by scanning ``photo_dir``.
+        """
+        pattern = "IMG_*" + TMP_SUFFIX
+        stale = itertools.chain(
+            self.photo_dir.glob(pattern), self.photo_dir.glob("*/" + pattern)
+        )
+        removed = 0
+        for path in stale:
+            try:
+                path.unlink()
+            except OSError:
+                LOGGER.warning(f"Couldn't remove stale copy {path}", exc_info=True)
+            else:
+                removed += 1
+        if removed:
+            LOGGER.warning(
+                f"Removed {removed} half-copied photos from {self.photo_dir}"
+            )
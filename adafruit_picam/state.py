@@ -1,14 +1,21 @@
 import contextlib
+import functools
 import time
 import typing as t
 from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import pygame
 import attr
-from sortedcontainers import SortedList
 
 from . import constants, camera, root_logger
+from .capacity import smaller_size_mode
+from .capture import BurstResult, CaptureWorker
+from .governor import Governor
+from .image_cache import ImageCache
 from .storage import Storage
+from .uploader import Uploader
+from .writer import ImageWriter
 from .config import Config, Settings
 
 if t.TYPE_CHECKING:
@@ -32,11 +39,28 @@ class State:
     # interfaces
     camera: "Camera"
     storage: Storage
+    writer: ImageWriter
+    image_cache: ImageCache
 
     # lifecycle state
     frame_times: deque
+    capture: t.Optional[CaptureWorker] = None
+    governor: t.Optional[Governor] = None
+    uploader: t.Optional[Uploader] = None
+    reconcile: t.Optional[Future] = None
+    """ Background check of the photo index against the photo directory """
     shutdown: bool = False
     took_picture: bool = False
+    last_burst: t.Optional[BurstResult] = None
+    settings_dirty: bool = False
+    """ Settings have changed since they were last saved """
+    settings_saved_at: float = 0
+    _settings_listeners: t.List[t.Callable[[Settings], None]] = attr.ib(factory=list)
+    """ Called with the settings each time they change """
+    storage_warning: t.Optional[str] = None
+    """ Message to show while photo storage is low or full """
+    downsized_from: t.Optional[constants.SizeMode] = None
+    """ Picture size before space ran low and it was stepped down automatically """
 
     # operating state
     screen_mode: constants.ScreenMode = constants.ScreenMode.viewfinder
@@ -44,11 +68,11 @@ class State:
     setting_idx: int = 0
 
     # image storage state
-    image_ids: SortedList = attr.ib(factory=SortedList)
-    """ All known stored image ids """
+    selected_image_id: t.Optional[int] = None
+    """ The photo shown by the image viewer; None if there aren't any"""
 
-    selected_image_index: int = None
-    """ The index of the selected image in the image_ids list"""
+    next_image_id: int = 0
+    """ Id for the next photo; ids still being written aren't in storage.ids yet"""
 
     last_image: t.Optional[pygame.Surface] = None
     last_image_id: t.Optional[int] = None
@@ -57,50 +81,277 @@ class State:
     def cleanup(self):
         """ Context manager that releases resources on exit
         """
-        with self.camera.cleanup():
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self.camera.cleanup())
+            if self.capture is not None:
+                stack.enter_context(self.capture.cleanup())
+            if self.uploader is not None:
+                # stopped last, so it hears about every photo that's written
+                stack.enter_context(self.uploader.cleanup())
+            if self.storage.staging is not None:
+                # after the writer is done, move everything out of staging
+                stack.enter_context(self.storage.staging.cleanup())
+            stack.enter_context(self.writer.cleanup())
+            stack.enter_context(self.image_cache.cleanup())
             yield
-            self.storage.save_settings(self.settings)
+        self.collect_writes()
+        self.save_settings()
 
     @classmethod
-    def initialize(cls: t.Type[T], cfg: Config) -> T:
+    def initialize(
+        cls: t.Type[T],
+        cfg: Config,
+        pixel_format: camera.PixelFormat = camera.DEFAULT_PIXEL_FORMAT,
+    ) -> T:
         storage = Storage.initialize(cfg)
         settings = storage.load_settings()
-        cam = camera.get_cls(fake=cfg.mock_camera).initialize(cfg)
-        image_indexes = storage.get_stored_ids()
+        cam = camera.get_cls(fake=cfg.mock_camera).initialize(cfg, pixel_format)
+        cam.setup(settings)
+        capture = None
+        if cfg.threaded_capture:
+            capture = CaptureWorker.initialize(cam, cfg.preview_buffers)
+        writer = ImageWriter.start(storage, cfg.write_queue_size, cfg.fsync_policy)
+        image_cache = ImageCache.start(
+            functools.partial(storage.load_image, target_size=cfg.screensize),
+            int(cfg.image_cache_mb * 2 ** 20),
+        )
+        uploader = None
+        if cfg.upload_backend is not None:
+            uploader = Uploader.start(cfg)
+            storage.ids.subscribe(uploader.photos_changed)
         state = cls(
             camera=cam,
+            writer=writer,
+            image_cache=image_cache,
+            capture=capture,
+            uploader=uploader,
+            governor=(
+                Governor.initialize(cfg, cam.max_preview_framerate)
+                if cfg.governor
+                else None
+            ),
+            reconcile=cls._start_reconcile(storage),
             cfg=cfg,
             settings=settings,
             storage=storage,
             frame_times=deque(maxlen=cfg.fps_window),
-            image_ids=SortedList(image_indexes),
-            selected_image_index=0 if image_indexes else None,
+            selected_image_id=storage.viewable_ids.first(),
+            next_image_id=storage.next_free_id(),
         )
+        storage.viewable_ids.subscribe(image_cache.photos_changed)
         return state
 
-    def get_display_image(self) -> t.Optional[pygame.Surface]:
+    def get_display_image(self) -> t.Tuple[t.Optional[pygame.Surface], bool]:
         """ Returns this image to draw - either the camera output or the loaded image
+
+        Returns:
+            The image, and whether it's a live frame. Live frames are refilled in
+            place, so the same surface holds a new picture every time.
         """
         if self.took_picture or self.screen_mode in (
             constants.ScreenMode.image_viewer,
             constants.ScreenMode.confirm_delete,
         ):
-            return self.load_image()
+            return self.load_image(), False
         else:
-            img = self.camera.get_preview()
+            if self.capture is not None:
+                img = self.capture.latest()
+            else:
+                img = self.camera.get_preview()
             self.last_image = img
             self.last_image_id = None
-            return img
+            return img, True
+
+    @staticmethod
+    def _start_reconcile(storage: Storage) -> t.Optional[Future]:
+        if storage.index is None:
+            return None
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(storage.reconcile_index)
+        executor.shutdown(wait=False)
+        return future
+
+    def subscribe_settings(self, listener: t.Callable[[Settings], None]):
+        self._settings_listeners.append(listener)
+
+    def settings_changed(self):
+        """ Tell listeners, and mark the settings for saving; they're written by
+        `poll_background`
+        """
+        self.settings_dirty = True
+        for listener in self._settings_listeners:
+            listener(self.settings)
+
+    def save_settings(self):
+        self.storage.save_settings(self.settings)
+        self.settings_dirty = False
+        self.settings_saved_at = time.monotonic()
+
+    def poll_background(self):
+        """ Apply the results of background work. To be called once each frame.
+        """
+        self.collect_writes()
+        if (
+            self.settings_dirty
+            and time.monotonic() - self.settings_saved_at
+            >= self.cfg.settings_save_interval_s
+        ):
+            # coalesces bursts of changes into one write per interval
+            self.save_settings()
+        self.check_capacity()
+        if self.reconcile is not None and self.reconcile.done():
+            future, self.reconcile = self.reconcile, None
+            try:
+                future.result()
+            except Exception:
+                LOGGER.error("photo index reconciliation failed", exc_info=True)
+        self.clamp_selection()
+
+    def check_capacity(self):
+        """ Update ``storage_warning``, and reduce the picture size if space is running out
+        and ``cfg.auto_downsize`` is set
+        """
+        capacity = self.storage.capacity
+        if capacity is None:
+            return
+        capacity.poll()
+        low = self.cfg.low_space_photos
+        if (
+            self.downsized_from is not None
+            and capacity.photos_left(self.downsized_from) >= low
+        ):
+            self.downsized_from = None  # space was freed, e.g. photos were deleted
+        left = capacity.photos_left(self.settings.size_mode)
+        # step down once while space is low; a size picked after that is kept
+        if left < low and self.cfg.auto_downsize and self.downsized_from is None:
+            smaller = smaller_size_mode(self.settings.size_mode)
+            if smaller is not None:
+                LOGGER.warning(
+                    f"Room for only {left} photos; picture size "
+                    f"{self.settings.size_mode.name} -> {smaller.name}"
+                )
+                self.downsized_from = self.settings.size_mode
+                self.settings.size_mode = smaller
+                self.settings_changed()
+                left = capacity.photos_left(smaller)
+
+        if left == 0:
+            self.storage_warning = "Storage full"
+        elif left < low:
+            self.storage_warning = f"Space for {left} photos"
+        else:
+            self.storage_warning = None
+
+    def photos_left(self) -> t.Optional[int]:
+        """ Estimated number of photos that still fit, or None if it isn't known
+        """
+        if self.storage.capacity is None:
+            return None
+        return self.storage.capacity.photos_left(self.settings.size_mode)
+
+    def record_photo(self, nbytes: int):
+        """ Note the size of a new photo, to improve the free space estimate
+        """
+        if self.storage.capacity is not None:
+            self.storage.capacity.record_photo(self.settings.size_mode, nbytes)
+
+    def clamp_selection(self):
+        """ Make sure a stored photo is selected, e.g. after the selected one is deleted
+
+        If there aren't any left, the image viewer gives way to the no-images screen.
+        """
+        ids = self.storage.viewable_ids
+        if self.selected_image_id is None:
+            self.selected_image_id = ids.last()
+        elif self.selected_image_id not in ids:
+            # the photo that followed it, or None if there aren't any left
+            self.selected_image_id = ids.neighbour(self.selected_image_id, 1)
+        if self.selected_image_id is None and self.screen_mode in (
+            constants.ScreenMode.image_viewer,
+            constants.ScreenMode.confirm_delete,
+        ):
+            self.last_screen_mode = self.screen_mode
+            self.screen_mode = constants.ScreenMode.no_images
+
+    @contextlib.contextmanager
+    def timed(self, stage: str):
+        """ Context manager that reports how long a stage of the main loop takes
+        """
+        if self.governor is None:
+            yield
+        else:
+            with self.governor.timed(stage):
+                yield
+
+    def govern(self, fps: float):
+        """ Let the governor adjust the preview based on the last frame's performance
+        """
+        if self.governor is None or self.screen_mode is not constants.ScreenMode.viewfinder:
+            return
+        mode = self.governor.update(fps)
+        if mode is None:
+            return
+
+        def configure():
+            self.camera.set_preview_mode(*mode)
+
+        if self.capture is not None:
+            self.capture.reconfigure(configure)
+        else:
+            configure()
 
-    def load_image(self) -> pygame.Surface:
+    def allocate_image_id(self) -> int:
+        """ Reserve the id for a new photo
+        """
+        imgid = self.next_image_id
+        self.next_image_id += 1
+        return imgid
+
+    def collect_writes(self):
+        """ Log the photos that the background writer has finished saving
+        """
+        written = self.writer.collect()
+        if written:
+            LOGGER.info(f"Saved pictures: {written}")
+
+    @contextlib.contextmanager
+    def camera_access(self):
+        """ Context manager for using the camera outside of the capture thread
+        """
+        if self.capture is None or self.camera.stills_during_preview:
+            yield
+        else:
+            with self.capture.paused():
+                yield
+
+    def load_image(self) -> t.Optional[pygame.Surface]:
         """ Return the currently selected image, loading it first if necessary
+
+        Returns None if no photo is selected, i.e. there aren't any.
         """
-        selected_id = self.image_ids[self.selected_image_index]
+        selected_id = self.selected_image_id
+        if selected_id is None:
+            self.last_image = self.last_image_id = None
+            return None
         if not self.last_image or (self.last_image_id != selected_id):
-            self.last_image = self.storage.load_image(selected_id)
+            self.last_image = self.image_cache.get(selected_id)
             self.last_image_id = selected_id
+            self.image_cache.prefetch(self._neighbour_ids())
         return self.last_image
 
+    def _neighbour_ids(self) -> t.List[int]:
+        """ Ids of the photos around the selected one, nearest first
+        """
+        ids = []
+        for distance in range(1, self.cfg.prefetch_images + 1):
+            for direction in (1, -1):
+                imgid = self.storage.viewable_ids.neighbour(
+                    self.selected_image_id, direction * distance
+                )
+                if imgid != self.selected_image_id and imgid not in ids:
+                    ids.append(imgid)
+        return ids
+
     def fps_tick(self) -> float:
         """ To be called once each frame.
 
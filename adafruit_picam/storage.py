@@ -1,13 +1,26 @@
 import contextlib
 import io
+import itertools
+import os
 import stat
+import threading
 import typing as t
 from pathlib import Path
 import attr
 
 import pygame
 
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
 from . import root_logger, config, util
+from .capacity import CapacityMonitor
+from .photo_ids import PhotoIds
+from .photo_index import PhotoIndex, CorruptIndex, INDEX_NAME
+from .staging import StagingArea
+from .thumbnails import ThumbnailCache, THUMB_DIR_NAME
 
 if t.TYPE_CHECKING:
     from .state import State
@@ -19,65 +32,335 @@ LOGGER = root_logger.getChild("io")
 
 PHOTO_DIR = Path("Photos")
 
+MIN_DRAFT_RATIO = 2
+""" Only decode at reduced scale if the photo is at least this many times the target size """
+
 
 @attr.s(auto_attribs=True, frozen=True)
 class Storage:
     settings_path: Path
     photo_dir: Path
-    image_ids: t.Dict[int, bool] = attr.ib(factory=dict)
+    ids: PhotoIds = attr.ib(factory=PhotoIds)
+    """ All durably stored photo ids. Subscribe to it to follow changes. """
+    viewable_ids: PhotoIds = attr.ib(factory=PhotoIds)
+    """ ``ids`` plus the photos still in staging: everything the image viewer can
+    show. The same object as ``ids`` without staging. """
+    shard_size: t.Optional[int] = None
+    """ Photos per subdirectory of ``photo_dir``, or None to store them all directly in it """
+    index: t.Optional[PhotoIndex] = None
+    """ Persistent list of stored ids, so startup doesn't have to scan ``photo_dir`` """
+    thumbnails: t.Optional[ThumbnailCache] = None
+    """ Screen-sized copies of photos for the image viewer """
+    capacity: t.Optional[CapacityMonitor] = None
+    """ Free space on the photo filesystem """
+    staging: t.Optional[StagingArea] = None
+    """ RAM-backed directory new photos are written to before moving to ``photo_dir`` """
+    _unpublished: t.Set[int] = attr.ib(factory=set)
+    """ Photos written straight to ``photo_dir`` that aren't known to be durable yet """
+    _lock: threading.Lock = attr.ib(factory=threading.Lock)
 
     @classmethod
     def initialize(cls: t.Type[T], cfg: config.Config) -> T:
         storage = Storage(
-            settings_path=cfg.settings_cache, photo_dir=cfg.photo_storage_dir
+            settings_path=cfg.settings_cache,
+            photo_dir=cfg.photo_storage_dir,
+            shard_size=cfg.photos_per_dir,
+        )
+        if cfg.thumbnail_cache_mb:
+            storage = attr.evolve(
+                storage,
+                thumbnails=ThumbnailCache(
+                    storage.photo_dir / THUMB_DIR_NAME,
+                    cfg.screensize,
+                    int(cfg.thumbnail_cache_mb * 2 ** 20),
+                ),
+            )
+        if cfg.photo_index:
+            index = storage.load_index()
+            storage = attr.evolve(storage, index=index, ids=index.ids)
+        else:
+            storage = attr.evolve(storage, ids=PhotoIds.from_ids(storage.scan_ids()))
+        if cfg.staging_dir is None:
+            storage = attr.evolve(storage, viewable_ids=storage.ids)
+        else:
+            with storage.ids.frozen():
+                storage = attr.evolve(
+                    storage, viewable_ids=PhotoIds.from_ids(storage.ids.snapshot())
+                )
+                storage.ids.subscribe(storage.photos_changed)
+            # staged photos only join ``ids`` once the flusher has made them durable
+            storage = attr.evolve(
+                storage,
+                staging=StagingArea.initialize(
+                    cfg.staging_dir,
+                    int(cfg.staging_mb * 2 ** 20),
+                    storage.photo_dir,
+                    storage.layout_path,
+                    storage.ids.add,
+                ),
+            )
+            storage.viewable_ids.add(*storage.staging.staged_ids())
+        if storage.thumbnails is not None:
+            storage.viewable_ids.subscribe(storage.thumbnails.photos_changed)
+        storage.photo_dir.mkdir(parents=True, exist_ok=True)
+        storage = attr.evolve(
+            storage,
+            capacity=CapacityMonitor.initialize(
+                storage.photo_dir,
+                int(cfg.storage_reserve_mb * 2 ** 20),
+                cfg.storage_check_interval_s,
+            ),
         )
         return storage
 
+    @property
+    def index_path(self) -> Path:
+        return self.photo_dir / INDEX_NAME
+
+    def load_index(self) -> PhotoIndex:
+        """ Load the photo index, building it from the photo directory if necessary
+        """
+        try:
+            return PhotoIndex.load(self.index_path)
+        except FileNotFoundError:
+            LOGGER.info("no photo index found; building one")
+        except CorruptIndex:
+            LOGGER.warning("photo index is corrupt; rebuilding it", exc_info=True)
+        self.photo_dir.mkdir(parents=True, exist_ok=True)
+        return PhotoIndex.create(self.index_path, self.scan_ids())
+
+    def rebuild_index(self) -> t.List[int]:
+        """ Replace the photo index with the contents of the photo directory
+        """
+        ids = self.scan_ids()
+        PhotoIndex.create(self.index_path, ids)
+        return ids
+
+    def reconcile_index(self) -> t.Tuple[t.List[int], t.List[int]]:
+        """ Bring the index up to date with the photo directory
+
+        Slow for large directories; meant to run in the background.
+
+        Returns:
+            The ids that were (added to, removed from) the index
+        """
+        known = self.ids.snapshot()
+        found = set(self.scan_ids())
+        # re-check each file in case it was written or deleted during the scan
+        added = sorted(i for i in found - known if self.imgpath(i).exists())
+        removed = sorted(i for i in known - found if not self.imgpath(i).exists())
+        self.ids.add(*added)
+        self.ids.remove(*removed)
+        if added or removed:
+            LOGGER.warning(
+                f"Photo index was out of date: {len(added)} ids added, "
+                f"{len(removed)} removed"
+            )
+        return added, removed
+
     def imgpath(self, idx: int) -> Path:
-        return self.photo_dir / f"IMG_{idx:04d}.JPG"
+        """ Where image ``idx`` is stored
+
+        New photos may still be in staging. Photos written before sharding was enabled
+        stay where they are, in ``photo_dir``.
+        """
+        path = self.layout_path(idx)
+        if path.exists():
+            return path
+        if self.staging is not None:
+            staged = self.staging.path(idx)
+            if staged.exists():
+                return staged
+        if self.shard_size is not None:
+            flat = self.photo_dir / path.name
+            if flat.exists():
+                return flat
+        return path
+
+    def next_free_id(self) -> int:
+        """ An id after every stored photo, for numbering new ones
+
+        Includes photos that aren't in ``ids`` yet: those still in staging, and
+        those written just before a crash and never published. Ids are handed out
+        in order, so the latter come straight after the last known one.
+        """
+        imgid = self.ids.last() + 1 if self.ids else 0
+        if self.staging is not None:
+            imgid = max([imgid] + [i + 1 for i in self.staging.staged_ids()])
+        while self.imgpath(imgid).exists():
+            imgid += 1
+        return imgid
+
+    def layout_path(self, idx: int) -> Path:
+        """ Where image ``idx`` belongs under the configured layout
+        """
+        # ids grow past 4 digits as needed
+        name = f"IMG_{idx:04d}.JPG"
+        if self.shard_size is None:
+            return self.photo_dir / name
+        else:
+            return self.photo_dir / f"{idx // self.shard_size:04d}" / name
 
     def increment_idx(self, current: int, inc: int) -> int:
         raise NotImplementedError()
 
     def save_settings(self, settings: config.Settings):
-        # util.dump_json(settings, self.settings_path)
-        pass
+        self.settings_path.parent.mkdir(parents=True, exist_ok=True)
+        util.dump_json(settings, self.settings_path)
 
     def load_settings(self) -> config.Settings:
-        return config.Settings()
-        # if not self.settings_path.is_file():
-        #     LOGGER.info("no settings file found; using defaults")
-        #     return config.Settings()
-        # else:
-        #     settings = util.load_json(config.Settings, self.settings_path)
-        #     return settings
-
-    def get_stored_ids(self) -> t.List[int]:
-        """ A list of all image idxes in the storage folder
+        if not self.settings_path.is_file():
+            LOGGER.info("no settings file found; using defaults")
+            return config.Settings()
+        try:
+            return util.load_json(config.Settings, self.settings_path)
+        except Exception:
+            LOGGER.warning("couldn't read settings; using defaults", exc_info=True)
+            return config.Settings()
+
+    def scan_ids(self) -> t.List[int]:
+        """ Find all image idxes by listing the storage folder
         """
-        indexes = []
-        for f in self.photo_dir.glob("IMG_*.JPG"):
+        indexes = set()
+        paths = self.photo_dir.glob("IMG_*.JPG")
+        if self.shard_size is not None:
+            paths = itertools.chain(paths, self.photo_dir.glob("*/IMG_*.JPG"))
+        for f in paths:
             try:
                 idx = int(f.name[4:-4])
-            except TypeError:
+            except ValueError:
                 LOGGER.warning(f'Failed to extract index from "{f.name}"')
             else:
-                indexes.append(idx)
-        return indexes
+                indexes.add(idx)
+        return sorted(indexes)
+
+    def load_image(
+        self, imgid: int, target_size: t.Optional[t.Tuple[int, int]] = None
+    ) -> pygame.Surface:
+        """ Load a photo for display, from the thumbnail cache if enabled
+
+        Args:
+            imgid: photo to load
+            target_size: size the photo will be displayed at, if it's known. Used to
+               decode a reduced-size image more quickly when it isn't cached.
+        """
+        if self.thumbnails is not None:
+            img = self.thumbnails.load(imgid)
+            if img is None:
+                full = self.load_full_image(imgid, target_size=self.thumbnails.size)
+                img = self.thumbnails.store(imgid, full)
+            return img
+        return self.load_full_image(imgid, target_size=target_size)
+
+    def load_full_image(
+        self, imgid: int, target_size: t.Optional[t.Tuple[int, int]] = None
+    ) -> pygame.Surface:
+        """ Decode a photo
 
-    def load_image(self, imgid: int) -> pygame.Surface:
+        Args:
+            imgid: photo to load
+            target_size: if given, and much smaller than the photo, the JPEG may be
+               decoded at 1/2, 1/4 or 1/8 scale (but never smaller than this size)
+        """
         path = self.imgpath(imgid)
-        img = pygame.image.load(str(path))
-        return img
+        try:
+            stream = path.open("rb")
+        except FileNotFoundError:
+            if self.staging is None:
+                raise
+            # moved out of staging since we looked
+            path = self.imgpath(imgid)
+            stream = path.open("rb")
+        with stream:
+            if target_size is not None and PILImage is not None:
+                img = _decode_scaled(stream, target_size)
+                if img is not None:
+                    return img
+                stream.seek(0)
+            return pygame.image.load(stream, path.name)
 
     @contextlib.contextmanager
-    def write_image(self, imgid: int) -> t.BinaryIO:
-        path = self.imgpath(imgid)
-        with path.open("wb") as stream:
-            yield stream
+    def write_image(self, imgid: int, fsync: bool = False) -> t.BinaryIO:
+        """ Context manager that opens a new photo for writing
+
+        With staging enabled, the photo goes there unless it's full; then it's
+        durable once the flusher has moved it, and ``fsync`` is ignored.
+
+        The photo isn't added to ``ids`` yet. Staged photos are added by the flusher,
+        and to ``viewable_ids`` right away; others must be passed to `publish` once
+        they're durable.
+        """
+        staged = self.staging is not None and self.staging.wait_for_room()
+        path = self.staging.path(imgid) if staged else self.layout_path(imgid)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            with path.open("wb") as stream:
+                yield stream
+                nbytes = stream.tell()
+                if fsync and not staged:
+                    stream.flush()
+                    os.fsync(stream.fileno())
+        except OSError:
+            # e.g. the disk filled up; the estimate is wrong, so re-read it
+            if self.capacity is not None:
+                self.capacity.refresh()
+            raise
+        if self.capacity is not None:
+            self.capacity.record_write(nbytes)
         path.chmod(stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+        if staged:
+            self.staging.add(imgid, nbytes)
+            self.viewable_ids.add(imgid)
+        else:
+            with self._lock:
+                self._unpublished.add(imgid)
+
+    def publish(self, *imgids: int):
+        """ Add photos written by `write_image` to ``ids``, now that they're durable
+
+        Photos that went to staging are skipped; the flusher adds them once it has
+        moved them to ``photo_dir``.
+        """
+        with self._lock:
+            durable = [i for i in imgids if i in self._unpublished]
+            self._unpublished.difference_update(durable)
+        self.ids.add(*durable)
+
+    def photos_changed(self, added: t.List[int], removed: t.List[int]):
+        """ `PhotoIds` listener that passes changes to ``ids`` on to ``viewable_ids`` """
+        self.viewable_ids.add(*added)
+        self.viewable_ids.remove(*removed)
 
     def delete_image(self, imgid: int):
-        path = self.imgpath(imgid)
-        path.unlink()
-        self.image_ids[imgid] = False
+        with contextlib.ExitStack() as stack:
+            if self.staging is not None:
+                # stop the flusher moving it while it's deleted
+                stack.enter_context(self.staging.lock)
+                self.staging.discard(imgid)
+            path = self.imgpath(imgid)
+            nbytes = path.stat().st_size
+            path.unlink()
+        if self.capacity is not None:
+            self.capacity.record_delete(nbytes)
+        self.ids.remove(imgid)
+        self.viewable_ids.remove(imgid)  # in case it was still staged
+
+
+def _decode_scaled(
+    stream: t.BinaryIO, target_size: t.Tuple[int, int]
+) -> t.Optional[pygame.Surface]:
+    """ Decode a JPEG at reduced size by skipping DCT coefficients
+
+    Returns:
+        The decoded image, or None if it isn't a JPEG much larger than ``target_size``
+    """
+    with PILImage.open(stream) as img:
+        if img.format != "JPEG" or (
+            img.width < MIN_DRAFT_RATIO * target_size[0]
+            and img.height < MIN_DRAFT_RATIO * target_size[1]
+        ):
+            return None
+        # picks the smallest DCT scale that's still at least target_size
+        img.draft("RGB", tuple(target_size))
+        img = img.convert("RGB")
+        return pygame.image.fromstring(img.tobytes(), img.size, "RGB")
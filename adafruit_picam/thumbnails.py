@@ -0,0 +1,161 @@
+import mmap
+import os
+import struct
+import threading
+import typing as t
+from collections import OrderedDict
+from pathlib import Path
+
+import attr
+import pygame
+
+from . import root_logger
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("thumbs")
+
+THUMB_DIR_NAME = ".thumbs"
+HEADER = struct.Struct("<4sHH")
+""" magic, width, height; followed by width * height packed RGB pixels """
+MAGIC = b"ACT1"
+
+
+@attr.s(auto_attribs=True)
+class ThumbnailCache:
+    """ Screen-sized copies of photos, stored as raw pixels so they load without decoding
+
+    Thumbnails are memory-mapped straight into pygame surfaces. The least recently
+    used are evicted once the cache grows past ``budget_bytes``; each use bumps the
+    file's mtime, so the order survives a restart. All methods are thread-safe.
+    """
+
+    directory: Path
+    size: t.Tuple[int, int]
+    budget_bytes: int
+    _entries: t.Optional["OrderedDict[int, int]"] = None
+    """ File size of each cached thumbnail, least recently used first """
+    _total_bytes: int = 0
+    _lock: threading.RLock = attr.ib(factory=threading.RLock)
+
+    @property
+    def entry_bytes(self) -> int:
+        return HEADER.size + self.size[0] * self.size[1] * 3
+
+    def path(self, imgid: int) -> Path:
+        return self.directory / f"{imgid}.thumb"
+
+    def load(self, imgid: int) -> t.Optional[pygame.Surface]:
+        """ The cached thumbnail for ``imgid``, or None if there isn't a valid one
+        """
+        try:
+            with self.path(imgid).open("rb") as stream:
+                # copy-on-write: pages are shared with the page cache, but the
+                # surface can't scribble on the file
+                data = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_COPY)
+        except (FileNotFoundError, ValueError):  # ValueError: empty file
+            return None
+
+        if len(data) != self.entry_bytes or HEADER.unpack_from(data) != (
+            MAGIC,
+            *self.size,
+        ):
+            LOGGER.warning(f"Discarding stale thumbnail for image {imgid}")
+            data.close()
+            self.discard(imgid)
+            return None
+
+        with self._lock:
+            if self._touch(imgid, len(data)):
+                self._mark_used(imgid)
+        return pygame.image.frombuffer(
+            memoryview(data)[HEADER.size :], self.size, "RGB"
+        )
+
+    def store(self, imgid: int, img: pygame.Surface) -> pygame.Surface:
+        """ Scale ``img`` to thumbnail size and cache it
+
+        Returns:
+            pygame.Surface: the thumbnail
+        """
+        if img.get_size() != self.size:
+            if img.get_bitsize() in (24, 32):
+                img = pygame.transform.smoothscale(img, self.size)
+            else:
+                img = pygame.transform.scale(img, self.size)
+        pixels = pygame.image.tostring(img, "RGB")
+
+        path = self.path(imgid)
+        tmp = path.with_suffix(".tmp")
+        with self._lock:
+            self.directory.mkdir(exist_ok=True)
+            with tmp.open("wb") as stream:
+                stream.write(HEADER.pack(MAGIC, *self.size))
+                stream.write(pixels)
+            os.replace(str(tmp), str(path))
+            self._touch(imgid, self.entry_bytes)
+            self._evict()
+        return img
+
+    def discard(self, imgid: int):
+        """ Remove ``imgid``'s thumbnail, e.g. because the photo was deleted
+        """
+        with self._lock:
+            try:
+                self.path(imgid).unlink()
+            except FileNotFoundError:
+                pass
+            if self._entries is not None and imgid in self._entries:
+                self._total_bytes -= self._entries.pop(imgid)
+
+    def photos_changed(self, added: t.List[int], removed: t.List[int]):
+        """ `PhotoIds` listener that drops deleted photos """
+        for imgid in removed:
+            self.discard(imgid)
+
+    def _touch(self, imgid: int, nbytes: int) -> bool:
+        """ Mark ``imgid`` as the most recently used; False if it already was """
+        self._load_entries()
+        if imgid in self._entries:
+            if next(reversed(self._entries)) == imgid:
+                return False
+            self._entries.move_to_end(imgid)
+        else:
+            self._entries[imgid] = nbytes
+            self._total_bytes += nbytes
+        return True
+
+    def _mark_used(self, imgid: int):
+        """ Bump the file's mtime, which orders the cache when it's next loaded
+
+        atime would do, but the card is usually mounted noatime.
+        """
+        try:
+            os.utime(str(self.path(imgid)))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        while self._total_bytes > self.budget_bytes and len(self._entries) > 1:
+            imgid, nbytes = self._entries.popitem(last=False)
+            self._total_bytes -= nbytes
+            try:
+                self.path(imgid).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _load_entries(self):
+        """ On first use, find existing thumbnails, least recently used first """
+        if self._entries is not None:
+            return
+        found = []
+        if self.directory.is_dir():
+            for entry in os.scandir(str(self.directory)):
+                name, _, ext = entry.name.partition(".")
+                if ext == "thumb" and name.isdigit():
+                    st = entry.stat()
+                    found.append((st.st_mtime, int(name), st.st_size))
+        self._entries = OrderedDict(
+            (imgid, nbytes) for _, imgid, nbytes in sorted(found)
+        )
+        self._total_bytes = sum(self._entries.values())
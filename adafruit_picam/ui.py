@@ -1,4 +1,5 @@
 import contextlib
+import functools
 import typing as t
 import pkg_resources
 from pathlib import Path
@@ -8,13 +9,14 @@ import attr
 import pygame, pygame.font
 
 from . import __name__ as pkgname, root_logger
+from . import camera
 from . import constants
 from . import elements
 from . import init_buttons
 from . import input_device
 
 if t.TYPE_CHECKING:
-    from .config import Config
+    from .config import Config, Settings
 
 
 T = t.TypeVar("T")
@@ -22,11 +24,39 @@ T = t.TypeVar("T")
 LOGGER = root_logger.getChild("app")
 ICON_PATH = Path(pkg_resources.resource_filename(pkgname, "icons"))
 GRAY = (128, 128, 128)
+RED = (255, 0, 0)
+WARNING_OFFSET_Y = 2
 FPS_OFFSET = (2, 2)
 FPS_FONT = "Helvetica"
 FPS_FONTSIZE = 8
 
 
+Overlay = t.Tuple[str, pygame.Surface, pygame.Rect]
+""" Text drawn over everything else: (text, rendered text, where it's drawn) """
+Layer = t.Tuple[pygame.Surface, t.Tuple[int, int]]
+""" A mode's buttons drawn onto one surface, and where it goes on the screen """
+
+
+@attr.s(auto_attribs=True)
+class _ScreenState:
+    """ What's currently on the screen, to work out what has to be redrawn """
+
+    valid: bool = False
+    img: t.Optional[pygame.Surface] = None
+    mode: t.Optional[constants.ScreenMode] = None
+    layer: t.Optional[Layer] = None
+    overlays: t.Dict[str, Overlay] = attr.ib(factory=dict)
+
+
+@attr.s(auto_attribs=True)
+class _ScaledImage:
+    """ The last still image scaled to fit the screen """
+
+    source: t.Optional[pygame.Surface] = None
+    size: t.Optional[t.Tuple[int, int]] = None
+    scaled: t.Optional[pygame.Surface] = None
+
+
 @attr.s(frozen=True, auto_attribs=True)
 class UI:
     size: t.Tuple[int, int]
@@ -35,19 +65,18 @@ class UI:
     screen: pygame.Surface
     font: pygame.font.Font
     input_dev: input_device.InputXface
+    preview_format: camera.PixelFormat = camera.DEFAULT_PIXEL_FORMAT
+    """ Camera pixel format that's cheapest to draw on this display """
+    _stretch_buffers: t.Dict[t.Tuple, pygame.Surface] = attr.ib(factory=dict)
+    _scaled: _ScaledImage = attr.ib(factory=_ScaledImage)
+    _shown: _ScreenState = attr.ib(factory=_ScreenState)
+    _layers: t.Dict[constants.ScreenMode, Layer] = attr.ib(factory=dict)
 
     @classmethod
     def initialize(cls: t.Type[T], cfg: "Config") -> T:
         """ Create UI elements and initialize pygame screen
         """
 
-        # load UI elements
-        icons = {}
-        for path in ICON_PATH.glob("*.png"):
-            icon = elements.Icon.load(path)
-            icons[icon.name] = icon
-        buttons = init_buttons.init_buttons()
-
         # initialize input device
         input_dev_cls = input_device.get_cls(cfg)
         input_dev = input_dev_cls.initialize(cfg)
@@ -61,7 +90,33 @@ class UI:
         screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
         font = pygame.font.SysFont(FPS_FONT, FPS_FONTSIZE)
 
-        ui = cls(cfg.screensize, icons, buttons, screen, font, input_dev=input_dev)
+        # load UI elements; icons are only decoded when they're first drawn
+        icons = {}
+        for path in ICON_PATH.glob("*.png"):
+            name = path.with_suffix("").name
+            icons[name] = elements.Icon(name, functools.partial(_load_icon, path))
+        buttons = init_buttons.init_buttons()
+
+        LOGGER.info(
+            f"Display: {screen.get_width()}x{screen.get_height()}, "
+            f"{screen.get_bitsize()}-bit, masks "
+            + "/".join(hex(m) for m in screen.get_masks())
+        )
+        if cfg.preview_format == "auto":
+            preview_format = best_preview_format(screen)
+        else:
+            preview_format = camera.PIXEL_FORMATS[cfg.preview_format]
+        LOGGER.info(f"Preview pixel format: {preview_format.name}")
+
+        ui = cls(
+            cfg.screensize,
+            icons,
+            buttons,
+            screen,
+            font,
+            input_dev=input_dev,
+            preview_format=preview_format,
+        )
         return ui
 
     @contextlib.contextmanager
@@ -75,17 +130,95 @@ class UI:
         self,
         img: t.Optional[pygame.Surface],
         mode: t.Optional[constants.ScreenMode],
+        live: bool = False,
         fps: t.Optional[float] = None,
+        warning: t.Optional[str] = None,
     ):
         """ Redraw photo and all UI elements
+
+        Only the parts of the screen that changed are sent to the display. Screens
+        showing the live preview change completely every frame, but other screens
+        only change when the image, mode or text does; often just the fps counter.
+
+        Args:
+            live: ``img`` is a live frame. The camera refills the same surfaces, so
+                a new frame can't be told from the last one by identity
         """
-        self.blit_image(img)
-        if mode is not None:
-            for button in self.buttons[mode]:
-                self.blit_button(button)
+        overlays = {}
         if fps is not None:
-            self.blit_fps(fps)
-        pygame.display.update()
+            overlays["fps"] = self._overlay("fps", str(round(fps, 1)), GRAY, FPS_OFFSET)
+        if warning is not None:
+            overlays["warning"] = self._overlay("warning", warning, RED)
+
+        layer = self.button_layer(mode)
+
+        shown = self._shown
+        if (
+            not shown.valid
+            or img is not shown.img
+            or layer is not shown.layer
+            or live
+        ):
+            self._draw(img, mode, live, layer, overlays)
+            pygame.display.update()
+        else:
+            dirty = []
+            for name in shown.overlays.keys() | overlays.keys():
+                old = shown.overlays.get(name)
+                new = overlays.get(name)
+                if old is not None and new is not None and old[0] == new[0]:
+                    continue
+                rects = [o[2] for o in (old, new) if o is not None]
+                dirty.append(rects[0].unionall(rects[1:]))
+            if dirty:
+                for rect in dirty:
+                    # redraw everything, but only inside the changed area
+                    self.screen.set_clip(rect)
+                    self._draw(img, mode, live, layer, overlays)
+                self.screen.set_clip(None)
+                pygame.display.update(dirty)
+
+        shown.valid = True
+        shown.img = img
+        shown.mode = mode
+        shown.layer = layer
+        shown.overlays = overlays
+
+    def _draw(
+        self,
+        img: t.Optional[pygame.Surface],
+        mode: t.Optional[constants.ScreenMode],
+        live: bool,
+        layer: t.Optional[Layer],
+        overlays: t.Dict[str, Overlay],
+    ):
+        self.blit_image(
+            img, stretch=mode is constants.ScreenMode.viewfinder, live=live
+        )
+        if layer is not None:
+            self.screen.blit(*layer)
+        for _, surface, rect in overlays.values():
+            self.screen.blit(surface, rect)
+
+    def _overlay(
+        self,
+        name: str,
+        text: str,
+        color: t.Tuple[int, int, int],
+        pos: t.Optional[t.Tuple[int, int]] = None,
+    ) -> Overlay:
+        """ Render ``text``, or reuse the last rendering if it hasn't changed
+
+        Args:
+            pos: top left corner; by default it's centered at the top of the screen
+        """
+        shown = self._shown.overlays.get(name)
+        if shown is not None and shown[0] == text:
+            return shown
+        surface = self.font.render(text, False, color)
+        if pos is None:
+            pos = ((self.size[0] - surface.get_width()) // 2, WARNING_OFFSET_Y)
+        return text, surface, surface.get_rect(topleft=pos)
 
     def get_event(
         self, screen_mode: constants.ScreenMode
@@ -109,18 +242,83 @@ class UI:
         else:
             return None
 
-    def blit_fps(self, val: float):
-        surface = self.font.render(str(round(val, 1)), False, GRAY)
-        self.screen.blit(surface, FPS_OFFSET)
+    def button_layer(
+        self, mode: t.Optional[constants.ScreenMode]
+    ) -> t.Optional[Layer]:
+        """ All of ``mode``'s buttons, drawn so they can be put on the screen with one blit
+        """
+        if mode is None:
+            return None
+        if mode not in self._layers:
+            surface = pygame.Surface(self.size, pygame.SRCALPHA)
+            for button in self.buttons[mode]:
+                self.blit_button(surface, button)
+            # most of the screen is transparent; leave that part out of the blit
+            area = surface.get_bounding_rect()
+            self._layers[mode] = (
+                surface.subsurface(area).convert_alpha(),
+                area.topleft,
+            )
+        return self._layers[mode]
+
+    def set_button(self, mode: constants.ScreenMode, name: str, **changes):
+        """ Change the button called ``name`` on ``mode``'s screen
+
+        Args:
+            changes: new values for `Button.load`'s arguments
+        """
+        buttons = self.buttons[mode]
+        idx, button = next((i, b) for i, b in enumerate(buttons) if b.name == name)
+        if all(getattr(button, k) == v for k, v in changes.items()):
+            return
+        kwargs = attr.asdict(button, recurse=False)
+        del kwargs["icon_bg"], kwargs["icon_fg"]
+        kwargs.update(changes)
+        buttons[idx] = elements.Button.load(**kwargs)
+        self._layers.pop(mode, None)
+
+    def sync_buttons(self, settings: "Settings"):
+        """ Make the settings screens show the current ``settings``
 
-    def blit_button(self, button: elements.Button):
-        """ Draw a button to the screen
+        Subscribed to `State.subscribe_settings`, so it runs only when they change.
+        """
+        for size_mode, name in (
+            (constants.SizeMode.lg, "size-l"),
+            (constants.SizeMode.med, "size-m"),
+            (constants.SizeMode.small, "size-s"),
+        ):
+            radio = "radio3-1" if settings.size_mode is size_mode else "radio3-0"
+            self.set_button(constants.ScreenMode.size_settings, name, bg_name=radio)
+        self.set_button(
+            constants.ScreenMode.effects,
+            "fx_mode",
+            bg_name=f"fx-{settings.fx_mode.value}",
+        )
+        iso = settings.iso_mode
+        self.set_button(
+            constants.ScreenMode.set_iso,
+            "iso_mode",
+            bg_name=f"iso-{0 if iso.iso == 'auto' else iso.iso}",
+        )
+        arrow_rect = next(
+            b.rect
+            for b in self.buttons[constants.ScreenMode.set_iso]
+            if b.name == "iso-arrow"
+        )
+        self.set_button(
+            constants.ScreenMode.set_iso,
+            "iso-arrow",
+            rect=(iso.x_pos - 10, *arrow_rect[1:]),
+        )
+
+    def blit_button(self, surface: pygame.Surface, button: elements.Button):
+        """ Draw a button onto ``surface``
         """
         if button.color:
-            self.screen.fill(button.color, button.rect)
+            surface.fill(button.color, button.rect)
         for icon in (button.icon_bg, button.icon_fg):
             if icon:
-                self.screen.blit(
+                surface.blit(
                     icon.bitmap,
                     (
                         button.rect[0] + (button.rect[2] - icon.bitmap.get_width()) / 2,
@@ -129,23 +327,79 @@ class UI:
                     ),
                 )
 
-    def blit_image(self, img: pygame.Surface):
+    def blit_image(
+        self, img: t.Optional[pygame.Surface], stretch: bool = False, live: bool = False
+    ):
         """ Draw an image to the screen
+
+        Args:
+            img: image to draw, or None to just clear the screen. Images larger than
+                the screen are scaled down
+            stretch: scale smaller images up to fill the screen, rather than letterboxing
+            live: ``img`` is a live frame, which the camera refills in place, so its
+                scaled copy can't be reused. Other images mustn't be changed once
+                they've been drawn
         """
-        if img.get_width() > self.size[0] or img.get_height() > self.size[1]:
-            img = pygame.transform.scale(img, self.size)
-        if (
-            img is None
-            or img.get_width() < self.size[0]
-            or img.get_height() < self.size[1]
-        ):  # Letterbox, clear background
+        if img is None:
             self.screen.fill(0)
+            return
+        oversized = img.get_width() > self.size[0] or img.get_height() > self.size[1]
+        if img.get_size() != self.size:
+            if stretch or (live and oversized):
+                img = self._stretch(img)
+            elif oversized:
+                img = self._scale(img)
+        if img.get_width() < self.size[0] or img.get_height() < self.size[1]:
+            self.screen.fill(0)  # Letterbox, clear background
+
+        self.screen.blit(
+            img,
+            (
+                (self.size[0] - img.get_width()) / 2,
+                (self.size[1] - img.get_height()) / 2,
+            ),
+        )
 
-        if img:
-            self.screen.blit(
-                img,
-                (
-                    (self.size[0] - img.get_width()) / 2,
-                    (self.size[1] - img.get_height()) / 2,
-                ),
+    def _scale(self, img: pygame.Surface) -> pygame.Surface:
+        """ Scale ``img`` down to the screen size, reusing the last result if it's the
+        same image
+        """
+        scaled = self._scaled
+        if scaled.source is not img or scaled.size != self.size:
+            scaled.source = img
+            scaled.size = self.size
+            scaled.scaled = elements.display_format(
+                pygame.transform.scale(img, self.size)
             )
+        return scaled.scaled
+
+    def _stretch(self, img: pygame.Surface) -> pygame.Surface:
+        """ Scale ``img`` to the screen size, reusing one buffer per pixel format
+        """
+        key = (img.get_bitsize(), img.get_masks())
+        if key not in self._stretch_buffers:
+            self._stretch_buffers[key] = pygame.Surface(self.size, 0, img)
+        return pygame.transform.scale(img, self.size, self._stretch_buffers[key])
+
+
+def _load_icon(path: Path) -> pygame.Surface:
+    return elements.display_format(pygame.image.load(str(path)))
+
+
+def best_preview_format(screen: pygame.Surface) -> camera.PixelFormat:
+    """ Pick the camera pixel format that's cheapest to convert to ``screen``'s format
+
+    The camera can't produce 16-bit RGB565, so 16-bit framebuffers like the PiTFT's
+    get XRGB8888, which SDL converts with a dedicated fast blitter.
+    """
+    bitsize = screen.get_bitsize()
+    masks = tuple(screen.get_masks()[:3])
+    for fmt in camera.PIXEL_FORMATS.values():
+        if bitsize == 8 * fmt.bytes_per_pixel and fmt.masks and masks == fmt.masks[:3]:
+            return fmt
+    if bitsize == 16:
+        return camera.PIXEL_FORMATS["bgra"]
+    elif bitsize == 32 and masks == (0xFF, 0xFF00, 0xFF0000):
+        return camera.PIXEL_FORMATS["rgba"]
+    else:
+        return camera.DEFAULT_PIXEL_FORMAT
@@ -0,0 +1,232 @@
+import contextlib
+import multiprocessing
+import os
+import queue
+import time
+import typing as t
+from pathlib import Path
+
+import attr
+
+from . import backends, config, root_logger, util
+from .storage import Storage
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("upload")
+
+UPLOAD_DIR_NAME = ".uploads"
+NICENESS = 19
+""" Lowest CPU priority, so uploads only use what the camera leaves spare """
+IDLE_POLL_S = 3600.0
+RETRY_BASE_S = 10.0
+RETRY_MAX_S = 3600.0
+JOIN_TIMEOUT_S = 5.0
+
+
+@attr.s(auto_attribs=True)
+class UploadJob:
+    imgid: int
+    attempts: int = 0
+    retry_at: float = 0
+    """ Wall clock time before which it isn't retried """
+    state: t.Dict[str, t.Any] = attr.ib(factory=dict)
+    """ Backend-specific progress, to resume an interrupted upload """
+
+
+@attr.s(auto_attribs=True)
+class UploadQueue:
+    """ Photos waiting to be uploaded, stored as one small file each so they survive restarts
+    """
+
+    directory: Path
+
+    def path(self, imgid: int) -> Path:
+        return self.directory / f"{imgid}.json"
+
+    def load(self) -> t.Dict[int, UploadJob]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        jobs = {}
+        for entry in os.scandir(str(self.directory)):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                job = util.load_json(UploadJob, Path(entry.path))
+            except Exception:
+                LOGGER.warning(
+                    f"Discarding unreadable upload job {entry.name}", exc_info=True
+                )
+                os.unlink(entry.path)
+            else:
+                jobs[job.imgid] = job
+        return jobs
+
+    def put(self, job: UploadJob):
+        util.dump_json(job, self.path(job.imgid))
+
+    def remove(self, imgid: int):
+        try:
+            self.path(imgid).unlink()
+        except FileNotFoundError:
+            pass
+
+
+@attr.s(auto_attribs=True)
+class Uploader:
+    """ Uploads new photos from a separate, low priority process
+
+    Uploading in another process keeps it from competing with the preview loop for
+    the GIL. The camera only sends it the ids of new and deleted photos; the upload
+    process keeps its own queue on disk and retries failed uploads with backoff.
+    """
+
+    requests: multiprocessing.Queue
+    process: multiprocessing.Process
+    _closed: bool = False
+
+    @classmethod
+    def start(cls: t.Type[T], cfg: config.Config) -> T:
+        # spawn rather than fork: the camera process is full of threads and locks
+        ctx = multiprocessing.get_context("spawn")
+        requests = ctx.Queue()
+        process = ctx.Process(
+            target=run_uploads,
+            args=(cfg, requests, root_logger.getEffectiveLevel()),
+            name="uploader",
+            daemon=True,
+        )
+        process.start()
+        return cls(requests, process)
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        """ Context manager that stops the upload process on exit
+
+        An upload that's still running is interrupted; it resumes at the next startup.
+        """
+        yield
+        self._closed = True
+        self.requests.put(None)
+        self.requests.close()
+        self.requests.join_thread()
+        self.process.join(timeout=JOIN_TIMEOUT_S)
+        if self.process.is_alive():
+            LOGGER.info("interrupting upload; it will resume at the next startup")
+            self.process.terminate()
+
+    def photos_changed(self, added: t.List[int], removed: t.List[int]):
+        """ `PhotoIds` listener that queues new photos for upload """
+        if self._closed:
+            return
+        for imgid in added:
+            self.requests.put(("add", imgid))
+        for imgid in removed:
+            self.requests.put(("remove", imgid))
+
+
+def run_uploads(cfg: config.Config, requests: multiprocessing.Queue, loglevel: int):
+    """ Main loop of the upload process
+    """
+    os.nice(NICENESS)
+    root_logger.setLevel(loglevel)
+    worker = UploadWorker.initialize(cfg)
+    with worker.backend.cleanup():
+        wait_s = 0.0
+        while True:
+            try:
+                request = requests.get(timeout=wait_s)
+            except queue.Empty:
+                wait_s = worker.upload_next()
+                continue
+            if request is None:
+                return
+            worker.handle(*request)
+            wait_s = 0.0
+
+
+@attr.s(auto_attribs=True)
+class UploadWorker:
+    cfg: config.Config
+    queue: UploadQueue
+    jobs: t.Dict[int, UploadJob]
+    storage: Storage
+    backend: backends.Backend
+
+    @classmethod
+    def initialize(cls: t.Type[T], cfg: config.Config) -> T:
+        upload_queue = UploadQueue(cfg.photo_storage_dir / UPLOAD_DIR_NAME)
+        jobs = upload_queue.load()
+        if jobs:
+            LOGGER.info(f"Resuming {len(jobs)} queued uploads")
+        throttle = backends.Throttle(
+            cfg.upload_kbps * 1024 if cfg.upload_kbps is not None else None
+        )
+        return cls(
+            cfg,
+            upload_queue,
+            jobs,
+            # just for finding photos; staging and the index belong to the camera
+            Storage(
+                cfg.settings_cache, cfg.photo_storage_dir, shard_size=cfg.photos_per_dir
+            ),
+            backends.get_cls(cfg.upload_backend).initialize(cfg, throttle),
+        )
+
+    def handle(self, op: str, imgid: int):
+        if op == "add":
+            job = UploadJob(imgid)
+            self.queue.put(job)
+            self.jobs[imgid] = job
+        elif op == "remove" and imgid in self.jobs:
+            self.queue.remove(imgid)
+            del self.jobs[imgid]
+
+    def upload_next(self) -> float:
+        """ Make one attempt at the next upload that's due
+
+        Returns:
+            float: how long to wait before calling again
+        """
+        if not self.jobs:
+            return IDLE_POLL_S
+        job = min(self.jobs.values(), key=lambda j: (j.retry_at, j.imgid))
+        wait_s = job.retry_at - time.time()
+        if wait_s > 0:
+            return wait_s
+
+        # photos are only published once they're in place, so a missing one was deleted
+        path = self.storage.imgpath(job.imgid)
+        if not path.exists():
+            LOGGER.warning(f"Image {job.imgid} no longer exists; not uploading it")
+            self._done(job)
+            return 0.0
+
+        key = self.storage.layout_path(job.imgid).relative_to(self.storage.photo_dir)
+        start = time.monotonic()
+        try:
+            self.backend.upload(
+                path, key.as_posix(), job.state, checkpoint=lambda: self.queue.put(job)
+            )
+        except backends.BackendUnavailable as exc:
+            LOGGER.info(f"Can't upload image {job.imgid}: {exc}")
+            self._retry(job)
+        except Exception:
+            LOGGER.warning(f"Failed to upload image {job.imgid}", exc_info=True)
+            self._retry(job)
+        else:
+            LOGGER.info(
+                f"Uploaded image {job.imgid} in {time.monotonic() - start:.1f}s"
+            )
+            self._done(job)
+        return 0.0
+
+    def _retry(self, job: UploadJob):
+        job.attempts += 1
+        job.retry_at = time.time() + min(
+            RETRY_MAX_S, RETRY_BASE_S * 2 ** (job.attempts - 1)
+        )
+        self.queue.put(job)
+
+    def _done(self, job: UploadJob):
+        self.queue.remove(job.imgid)
+        del self.jobs[job.imgid]
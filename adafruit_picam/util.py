@@ -10,9 +10,16 @@ T = t.TypeVar("T")
 
 
 def dump_json(obj: t.Any, dest: Path):
+    """ Write ``obj`` to ``dest`` atomically: after a crash, either the old or the new
+    file will be there in full
+    """
     data = cattr.unstructure(obj)
-    with dest.open("w") as stream:
+    tmp = dest.with_name(dest.name + ".tmp")
+    with tmp.open("w") as stream:
         json.dump(data, stream)
+        stream.flush()
+        os.fsync(stream.fileno())
+    os.replace(str(tmp), str(dest))
 
 
 def load_json(cl: t.Type[T], src: Path) -> T:
@@ -0,0 +1,118 @@
+import contextlib
+import os
+import queue
+import threading
+import typing as t
+
+import attr
+
+from . import root_logger
+from .constants import FsyncPolicy
+
+if t.TYPE_CHECKING:
+    from .storage import Storage
+
+T = t.TypeVar("T")
+
+LOGGER = root_logger.getChild("writer")
+
+JOIN_TIMEOUT_S = 30.0
+
+
+@attr.s(auto_attribs=True)
+class ImageWriter:
+    """ Background thread that writes encoded images to storage
+
+    Images wait in a bounded in-memory queue, so encoding and disk writes can
+    overlap with capture without unbounded memory use. Once images have been
+    durably written (according to ``fsync``), they're published to storage and
+    their ids are reported by `collect`.
+    """
+
+    storage: "Storage"
+    pending: queue.Queue
+    fsync: FsyncPolicy = FsyncPolicy.batch
+    error: t.Optional[BaseException] = None
+
+    _durable: queue.Queue = attr.ib(factory=queue.Queue)
+    _unsynced: t.List[int] = attr.ib(factory=list)
+    _thread: t.Optional[threading.Thread] = None
+
+    @classmethod
+    def start(
+        cls: t.Type[T],
+        storage: "Storage",
+        queue_size: int,
+        fsync: FsyncPolicy = FsyncPolicy.batch,
+    ) -> T:
+        writer = cls(storage, queue.Queue(maxsize=queue_size), fsync=fsync)
+        writer._thread = threading.Thread(target=writer.run, name="writer", daemon=True)
+        writer._thread.start()
+        return writer
+
+    @contextlib.contextmanager
+    def cleanup(self):
+        """ Context manager that finishes all queued writes on exit
+        """
+        yield
+        self.pending.put(None)
+        self._thread.join(timeout=JOIN_TIMEOUT_S)
+        if self._thread.is_alive():
+            LOGGER.error("writer thread failed to finish; recent photos may be lost")
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self._sync()
+                return
+            imgid, data = item
+            try:
+                with self.storage.write_image(
+                    imgid, fsync=self.fsync is FsyncPolicy.always
+                ) as stream:
+                    stream.write(data)
+            except Exception as exc:
+                LOGGER.error(f"Failed to write image {imgid}", exc_info=True)
+                self.error = exc
+            else:
+                if self.fsync is FsyncPolicy.batch:
+                    self._unsynced.append(imgid)
+                else:
+                    self.storage.publish(imgid)
+                    self._durable.put(imgid)
+            if self.pending.empty():
+                self._sync()
+
+    def _sync(self):
+        """ Sync batched writes to disk, then report them as durable
+        """
+        if not self._unsynced:
+            return
+        os.sync()
+        self.storage.publish(*self._unsynced)
+        for imgid in self._unsynced:
+            self._durable.put(imgid)
+        self._unsynced.clear()
+
+    def submit(self, imgid: int, data: bytes, block: bool = False) -> bool:
+        """ Queue an image for writing
+
+        Returns:
+            bool: False if the queue was full and ``block`` is False, i.e. the image was dropped
+        """
+        try:
+            self.pending.put((imgid, data), block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def collect(self) -> t.List[int]:
+        """ Ids of the images that became durable since the last call. Never blocks.
+        """
+        ids = []
+        while True:
+            try:
+                ids.append(self._durable.get_nowait())
+            except queue.Empty:
+                return ids
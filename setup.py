@@ -12,13 +12,18 @@ setup(
         "evdev~=1.3.0",
         "picamera~=1.13",
         "pygame~=1.9.4",
-        "sortedcontainers~=2.3.0",
     ],
+    extras_require={"fast-decode": ["Pillow>=5.4"], "s3": ["boto3>=1.16"]},
     package_data={"adafruit_picam": ["icons/*"]},
     include_package_data=True,
     license="BSD-2-Clause",
     description="Adafruit pi camera, updated for python 3",
     use_scm_version=True,
     cmdclass=versioneer.get_cmdclass(),
-    entry_points={"console_scripts": ["adapicam=adafruit_picam.main:entrypoint"]},
+    entry_points={
+        "console_scripts": [
+            "adapicam=adafruit_picam.main:entrypoint",
+            "adapicam-reindex=adafruit_picam.main:rebuild_index",
+        ]
+    },
 )
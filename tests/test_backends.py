@@ -0,0 +1,133 @@
+""" Upload backends against a local S3 stand-in
+
+Needs the ``s3`` extra and moto's server (``pip install "moto[server]"``).
+"""
+import math
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("boto3")
+moto_server = pytest.importorskip("moto.server")
+
+from adafruit_picam import backends, config  # noqa: E402
+
+BUCKET = "photos"
+CHUNK_BYTES = 64 * 1024
+BURST_BYTES = 16 * 1024
+JITTER_S = 0.02
+""" Scheduling delays that can bunch up what the proxy sees, at the test's rate """
+
+
+class WireLog:
+    """ TCP proxy that records when the client's bytes go out on the wire """
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.sent = []
+        """ (time, bytes) of every chunk the client sent """
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self.listener.close()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:  # closed
+                return
+            server = socket.create_connection(self.upstream)
+            threading.Thread(
+                target=self._pump, args=(client, server, True), daemon=True
+            ).start()
+            threading.Thread(
+                target=self._pump, args=(server, client, False), daemon=True
+            ).start()
+
+    def _pump(self, src, dest, record):
+        with src, dest:
+            while True:
+                try:
+                    data = src.recv(65536)
+                    if not data:
+                        return
+                    if record:
+                        self.sent.append((time.monotonic(), len(data)))
+                    dest.sendall(data)
+                except OSError:  # the other direction closed the connection
+                    return
+
+    def max_excess(self, bytes_per_s):
+        """ Most bytes sent in any interval beyond what the limit allows for it """
+        total = 0
+        # least (bytes sent before chunk i - allowance up to chunk i) over chunks so far
+        lowest = math.inf
+        excess = 0.0
+        for when, nbytes in self.sent:
+            lowest = min(lowest, total - when * bytes_per_s)
+            total += nbytes
+            excess = max(excess, total - when * bytes_per_s - lowest)
+        return excess
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=port)
+    server.start()
+    wire = WireLog(("127.0.0.1", port))
+    yield wire
+    wire.close()
+    server.stop()
+
+
+def make_backend(wire, bytes_per_s):
+    cfg = config.Config(
+        upload_backend="s3",
+        upload_s3_bucket=BUCKET,
+        upload_s3_endpoint=f"http://127.0.0.1:{wire.port}",
+        upload_part_mb=5,
+    )
+    throttle = backends.Throttle(bytes_per_s, burst_bytes=BURST_BYTES)
+    backend = backends.get_cls("s3").initialize(cfg, throttle)
+    backend.client.create_bucket(Bucket=BUCKET)
+    return backend
+
+
+@pytest.mark.parametrize(
+    "size, bytes_per_s",
+    [
+        (512 * 1024, 256 * 1024),  # one put_object
+        (6 * 2 ** 20, 8 * 2 ** 20),  # two parts of a multipart upload
+    ],
+)
+def test_s3_upload_is_throttled_on_the_wire(s3, tmp_path, size, bytes_per_s):
+    backend = make_backend(s3, bytes_per_s)
+    src = tmp_path / "IMG_0001.JPG"
+    src.write_bytes(os.urandom(size))
+
+    start = time.monotonic()
+    backend.upload(src, "0000/IMG_0001.JPG", {}, checkpoint=lambda: None)
+    elapsed = time.monotonic() - start
+
+    # over any interval, never ahead of the limit by more than the burst, one read,
+    # the request headers, and timing jitter
+    allowed = BURST_BYTES + CHUNK_BYTES + 16 * 1024 + JITTER_S * bytes_per_s
+    assert s3.max_excess(bytes_per_s) < allowed
+    # and the body is only throttled once, not again for checksums
+    assert elapsed < 1.5 * size / bytes_per_s + 1
+    obj = backend.client.get_object(Bucket=BUCKET, Key="0000/IMG_0001.JPG")
+    assert obj["Body"].read() == src.read_bytes()